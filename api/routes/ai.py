@@ -1,51 +1,266 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Request, Form, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request, Form, Depends, Header
 from fastapi.responses import StreamingResponse,JSONResponse
-from dependencies.auth import inject_user_into_request
+from dependencies.auth import inject_user_into_request, Principal
+from dependencies.quota import require_quota
 from services.ai_service import AiService
-from db.models import User
+from services.parser_registry import parser_registry
+from services.usage import usage_accountant
+from services.jobs import job_runner, validate_webhook_url, JOB_KINDS
+from services.uploads import inspect_upload
+from repositories.ai_jobs import get_job
+from db.mysql import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.config import settings
 from pydantic import BaseModel
-from typing import Optional, Dict, List
+from typing import Awaitable, Callable, Optional, Dict, List
+import asyncio
+import json
 
 router = APIRouter(tags=["AI Features"])
 
 
+def _check_batch_size(files: List[UploadFile]):
+    if len(files) > settings.BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {settings.BATCH_MAX_FILES} files")
+
+
+async def _metered(user_id: int, counter: str, parse: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+    """
+    Run one parse against the user's quota: a unit is reserved before the
+    model call, so concurrent requests cannot all pass the same check, and
+    given back if the parse fails.
+    """
+    usage_accountant.reserve(user_id, counter)
+    result = None
+    try:
+        result = await parse()
+    finally:
+        if result is None:
+            usage_accountant.refund(user_id, counter)
+    return result
+
+
+async def _stream_batch(
+    files: List[UploadFile],
+    parse: Callable[[UploadFile], Awaitable[Optional[Dict]]],
+    user_id: int,
+    counter: str,
+):
+    """
+    Parse files concurrently (at most BATCH_MAX_CONCURRENCY at a time) and
+    yield one NDJSON line per file in completion order. Pending parses are
+    cancelled if the client goes away.
+    """
+    semaphore = asyncio.Semaphore(settings.BATCH_MAX_CONCURRENCY)
+
+    async def run(index: int, file: UploadFile):
+        async with semaphore:
+            try:
+                # Every file takes its own unit of quota, so a batch cannot run past the plan limit
+                usage_accountant.reserve(user_id, counter)
+            except HTTPException as e:
+                return index, file, None, e.detail
+            result = None
+            try:
+                result = await parse(file)
+                return index, file, result, None
+            except HTTPException as e:
+                return index, file, None, e.detail
+            except Exception as e:
+                return index, file, None, str(e)
+            finally:
+                if result is None:
+                    usage_accountant.refund(user_id, counter)
+
+    tasks = [asyncio.create_task(run(index, file)) for index, file in enumerate(files)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, file, result, error = await next_done
+            if result is None and error is None:
+                error = "Failed to parse document"
+            yield json.dumps({
+                "index": index,
+                "filename": file.filename,
+                "result": result,
+                "error": error,
+            }) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 @router.post("/status")
-async def status(user: User = Depends(inject_user_into_request)):
+async def status(user: Principal = Depends(inject_user_into_request)):
     return {"message":"ok"}
 
 @router.post("/receipt-parser")
-async def receipt_parser(image: UploadFile = File(...), user: User = Depends(inject_user_into_request)):
-    ai_service = AiService()
-    return await ai_service.receipt_parser(image)
+async def receipt_parser(
+    image: UploadFile = File(...),
+    cache_bypass: bool = Header(False, alias="X-Cache-Bypass"),
+    user: Principal = Depends(require_quota("receipt_scans"))
+):
+    ai_service = AiService(cache_bypass=cache_bypass, user_id=user.id)
+    return await _metered(user.id, "receipt_scans", lambda: ai_service.receipt_parser(image))
+
+@router.post("/receipt-parser/batch")
+async def receipt_parser_batch(
+    images: List[UploadFile] = File(...),
+    cache_bypass: bool = Header(False, alias="X-Cache-Bypass"),
+    user: Principal = Depends(require_quota("receipt_scans"))
+):
+    _check_batch_size(images)
+    ai_service = AiService(cache_bypass=cache_bypass, user_id=user.id)
+    return StreamingResponse(
+        _stream_batch(images, ai_service.receipt_parser, user.id, "receipt_scans"),
+        media_type="application/x-ndjson",
+    )
 
 @router.post("/resume-parser")
 async def resume_parser(
     document: UploadFile = File(...),
     positions: Optional[List[str]] = Form(None),  # <-- important!
-    user: User = Depends(inject_user_into_request)
+    cache_bypass: bool = Header(False, alias="X-Cache-Bypass"),
+    user: Principal = Depends(require_quota("any_scans"))
 ):
-    ai_service = AiService()
-    return await ai_service.resume_parser(document=document, positions=positions)
+    ai_service = AiService(cache_bypass=cache_bypass, user_id=user.id)
+    return await _metered(user.id, "any_scans", lambda: ai_service.resume_parser(document=document, positions=positions))
 
 @router.post("/vclaim-parser")
 async def vclaim_parser(
     custom_fields: Optional[str] = Form(None),  # Accept JSON string
     image: UploadFile = File(...),
-    user: User = Depends(inject_user_into_request)
+    cache_bypass: bool = Header(False, alias="X-Cache-Bypass"),
+    user: Principal = Depends(require_quota("invoice_scans"))
 ):
-    import json
     parsed_fields = json.loads(custom_fields) if custom_fields else None
 
-    ai_service = AiService()
-    return await ai_service.vclaim_parser(image, parsed_fields)
+    ai_service = AiService(cache_bypass=cache_bypass, user_id=user.id)
+    return await _metered(user.id, "invoice_scans", lambda: ai_service.vclaim_parser(image, parsed_fields))
 
 
+@router.post("/vclaim-parser/batch")
+async def vclaim_parser_batch(
+    custom_fields: Optional[str] = Form(None),  # Accept JSON string, applied to every file
+    images: List[UploadFile] = File(...),
+    cache_bypass: bool = Header(False, alias="X-Cache-Bypass"),
+    user: Principal = Depends(require_quota("invoice_scans"))
+):
+    _check_batch_size(images)
+    parsed_fields = json.loads(custom_fields) if custom_fields else None
+
+    ai_service = AiService(cache_bypass=cache_bypass, user_id=user.id)
+    return StreamingResponse(
+        _stream_batch(images, lambda image: ai_service.vclaim_parser(image, parsed_fields), user.id, "invoice_scans"),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/parsers/{name}")
+async def registry_parser(
+    name: str,
+    document: UploadFile = File(...),
+    custom_fields: Optional[str] = Form(None),  # Accept JSON string, for parsers that take custom fields
+    cache_bypass: bool = Header(False, alias="X-Cache-Bypass"),
+    user: Principal = Depends(inject_user_into_request)
+):
+    definition = parser_registry.get(name)
+    if definition is None or definition.internal:
+        raise HTTPException(status_code=404, detail=f"Unknown parser: {name}")
+    if definition.counter:
+        usage_accountant.check(user.id, definition.counter)
+    parsed_fields = json.loads(custom_fields) if custom_fields else None
+
+    ai_service = AiService(cache_bypass=cache_bypass, user_id=user.id)
+    if not definition.counter:
+        return await ai_service.parse(name, document, parsed_fields)
+    return await _metered(user.id, definition.counter, lambda: ai_service.parse(name, document, parsed_fields))
+
+
+@router.post("/jobs", status_code=202)
+async def submit_job(
+    kind: str = Form(...),  # receipt | vclaim | resume
+    document: UploadFile = File(...),
+    custom_fields: Optional[str] = Form(None),  # vclaim only, JSON string
+    positions: Optional[List[str]] = Form(None),  # resume only
+    webhook_url: Optional[str] = Form(None),
+    user: Principal = Depends(inject_user_into_request)
+):
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(JOB_KINDS)}")
+    usage_accountant.check(user.id, JOB_KINDS[kind])
+    if webhook_url:
+        await validate_webhook_url(webhook_url, settings.JOB_WEBHOOK_ALLOWED_HOSTS)
+    await inspect_upload(document)  # Reject junk before it is spooled and queued
+
+    params = {}
+    if custom_fields:
+        params["custom_fields"] = json.loads(custom_fields)
+    if positions:
+        params["positions"] = positions
+
+    # The job holds a unit of quota from submission; the runner gives it back if the job fails
+    usage_accountant.reserve(user.id, JOB_KINDS[kind])
+    try:
+        job = await job_runner.submit(user.id, kind, document, params, webhook_url)
+    except BaseException:
+        usage_accountant.refund(user.id, JOB_KINDS[kind])
+        raise
+    return {"job_id": job.id, "status": job.status}
+
+@router.get("/jobs/{job_id}")
+async def job_status(
+    job_id: str,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(inject_user_into_request)
+):
+    job = await get_job(db, job_id)
+    if not job or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "filename": job.filename,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+    }
+
 
 class SummaryInput(BaseModel):
     text: str
+    stream: bool = False  # Send the answer as server-sent events while it is generated
+
+
+def _sse(data: Dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def _stream_chat(ai_service: AiService, prompt: str):
+    try:
+        async for text in ai_service.chat_stream(prompt):
+            yield _sse({"text": text})
+    except HTTPException as e:
+        yield _sse({"detail": e.detail}, event="error")
+        return
+    except Exception as e:
+        yield _sse({"detail": f"AI summary error: {str(e)}"}, event="error")
+        return
+    yield _sse({}, event="done")
 
 @router.post("/chat")
-async def chat(data: SummaryInput, user: User = Depends(inject_user_into_request)):
-    ai_service = AiService()
+async def chat(data: SummaryInput, user: Principal = Depends(inject_user_into_request)):
+    ai_service = AiService(user_id=user.id)
+    if data.stream:
+        return StreamingResponse(
+            _stream_chat(ai_service, data.text),
+            media_type="text/event-stream",
+            # X-Accel-Buffering stops NGINX from holding events back
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
     result = await ai_service.chat(data.text)
     return { "result": result }
\ No newline at end of file
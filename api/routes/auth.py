@@ -1,11 +1,12 @@
 # 6. api/auth.py
 from fastapi import APIRouter, Depends, HTTPException, status, Response
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from db.mysql import get_db
 from db.models import User
 from pydantic import BaseModel
-from core.security import hash_password, verify_password, create_token
+from core.security import verify_and_update_password, create_token
 import logging
 from datetime import datetime
 from api.models.login_request import LoginRequest
@@ -18,10 +19,11 @@ logger = logging.getLogger(__name__)
 
 
 @router.post("/login", response_model=dict)
-async def login(data: LoginRequest, db: Session = Depends(get_db)):
+async def login(data: LoginRequest, db: AsyncSession = Depends(get_db)):
     try:
         # Query user from database
-        user = db.query(User).filter(User.username == data.username).first()
+        result = await db.execute(select(User).where(User.username == data.username))
+        user = result.scalars().first()
         if not user:
             logger.warning(f"Login attempt with non-existent username: {data.username}")
             raise HTTPException(
@@ -30,8 +32,9 @@ async def login(data: LoginRequest, db: Session = Depends(get_db)):
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        # Verify password
-        if not verify_password(data.password, user.password):
+        # Verify password off the event loop
+        valid, new_hash = await verify_and_update_password(data.password, user.password)
+        if not valid:
             logger.warning(f"Invalid password attempt for username: {data.username}")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,6 +42,12 @@ async def login(data: LoginRequest, db: Session = Depends(get_db)):
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
+        # Stored hash uses an outdated cost factor: replace it while we know the password
+        if new_hash:
+            user.password = new_hash
+            await db.commit()
+            logger.info(f"Rehashed password for username: {data.username}")
+
         # Generate JWT token
         token = create_token(user.id)
         logger.info(f"Successful login for username: {data.username} at {datetime.utcnow()}")
@@ -50,6 +59,8 @@ async def login(data: LoginRequest, db: Session = Depends(get_db)):
             "message": "Login successful"
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Login error for username {data.username}: {str(e)}")
         raise HTTPException(
@@ -1,38 +1,49 @@
 # 7. api/dev_user.py
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from sqlalchemy import delete, select
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from db.mysql import get_db
 from db.models import User
 from pydantic import BaseModel
-from passlib.context import CryptContext
 import os
+from typing import Optional
 from api.models.dev import UserEditSchema, UserCreateSchema, UserSubscriptionSchema
 from dependencies.user import get_user_by_id
 from dependencies.dev_auth import verify_dev_token
+from dependencies.auth import invalidate_principal, principal_cache
+from core.security import token_cache, hash_password_async
 from repositories.api_usage import get_monthly_api_usage
+from services.ai_service import resume_path_latency
+from services.providers import model_call_limiter, gemini_provider, model_router
+from services.result_cache import parse_result_cache
+from services.parser_registry import parser_registry
+from services.preprocess import preprocessor, text_layer_extractor
+from services.log_writer import api_call_log_writer
+from services.usage import usage_accountant
+from services.jobs import job_runner
+from services.admission import admission_controller
 
 router = APIRouter(
     tags=["Dev"],
     dependencies=[Depends(verify_dev_token)]
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
 from fastapi import HTTPException, status
 
 @router.post("/users")
-def create_user(user_data: UserCreateSchema, db: Session = Depends(get_db)):
+async def create_user(user_data: UserCreateSchema, db: AsyncSession = Depends(get_db)):
     # Check if username already exists
-    existing_user = db.query(User).filter_by(username=user_data.username).first()
+    result = await db.execute(select(User.id).where(User.username == user_data.username))
+    existing_user = result.first()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already exists"
         )
 
-    # Hash the plaintext password
-    hashed_password = pwd_context.hash(user_data.password)
+    # Hash the plaintext password off the event loop
+    hashed_password = await hash_password_async(user_data.password)
 
     # Create user
     user = User(
@@ -40,8 +51,8 @@ def create_user(user_data: UserCreateSchema, db: Session = Depends(get_db)):
         password=hashed_password
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return {"status": "user created", "user_id": user.id}
 
@@ -72,27 +83,67 @@ def view_user(user: User = Depends(get_user_by_id)):
     }
 
 @router.get("/users_usage_monthly")
-def usage_stats(db: Session = Depends(get_db)):
-    return get_monthly_api_usage(db) 
+async def usage_stats(
+    month_from: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    month_to: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    user_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    # Original shape: {month: {user_id: {...}}}, unpaged
+    usage = await get_monthly_api_usage(db, month_from, month_to, user_id)
+    return usage["months"]
+
+@router.get("/v2/users_usage_monthly")
+async def usage_stats_paged(
+    month_from: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    month_to: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    user_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    # Paged over (month, user) pairs: {"months": {...}, "limit", "offset", "has_more"}
+    return await get_monthly_api_usage(db, month_from, month_to, user_id, limit, offset)
+
+@router.get("/metrics")
+def metrics():
+    return {
+        "model_calls": model_call_limiter.stats(),
+        "model_resilience": gemini_provider.caller.stats(),
+        "model_routing": model_router.stats(),
+        "parse_cache": parse_result_cache.stats() if parse_result_cache else None,
+        "parsers": parser_registry.stats(),
+        "resume_paths": {path: latency.stats() for path, latency in resume_path_latency.items()},
+        "preprocess": preprocessor.stats() if preprocessor else None,
+        "pdf_text_layer": text_layer_extractor.stats() if text_layer_extractor else None,
+        "log_writer": api_call_log_writer.stats(),
+        "principal_cache": principal_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "usage": usage_accountant.stats(),
+        "jobs": job_runner.stats(),
+        "admission": admission_controller.stats() if admission_controller else None,
+    }
 
 
 @router.put("/users/{user_id}")
-def edit_user(
+async def edit_user(
     user_id: int,
     data: UserEditSchema, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user.system_prompt = data.get("system_prompt", user.system_prompt)
-    db.commit()
+    user.password = await hash_password_async(data.password)
+    await db.commit()
+    invalidate_principal(user_id)
     return {"status": "user updated"}
 
 @router.delete("/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    db.query(User).filter(User.id == user_id).delete()
-    db.commit()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    await db.execute(delete(User).where(User.id == user_id))
+    await db.commit()
+    invalidate_principal(user_id)
     return {"status": "user deleted"}
 
 @router.get("/subscriptions")
@@ -0,0 +1,37 @@
+from collections import deque
+from typing import Optional
+
+
+class LatencyStats:
+    """
+    Rolling window of recent durations (in seconds) with simple percentiles.
+
+    Not thread-safe; meant to be used from the event loop only.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._samples: "deque[float]" = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> dict:
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "count": self.count,
+            "avg_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.5)),
+            "p95_ms": ms(self.percentile(0.95)),
+        }
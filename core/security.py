@@ -1,10 +1,16 @@
+import asyncio
+import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import jwt, JWTError  # <--- CHANGE HERE
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
 from dotenv import load_dotenv
+from core.cache import TTLCache
+from core.config import settings
 
 # Load environment variables
 load_dotenv()
@@ -14,8 +20,25 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secure-secret-key")  # Replace wi
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 3000000
 
-# Password hashing configuration
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Already-verified tokens, keyed by SHA-256 of the token; each entry expires at the token's exp
+token_cache = TTLCache(max_entries=settings.JWT_CACHE_MAX_ENTRIES, ttl_seconds=0)
+_token_cache_secret = SECRET_KEY
+
+# Password hashing configuration; hashes with fewer rounds than BCRYPT_ROUNDS count as outdated
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop.
+# The semaphore bounds running + queued jobs so a login burst cannot grow the backlog forever.
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+_hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -54,6 +77,65 @@ def hash_password(password: str) -> str:
             detail=f"Password hashing error: {str(e)}"
         )
 
+def _release_hash_slot(future: asyncio.Future):
+    _hash_slots.release()
+    if not future.cancelled():
+        future.exception()  # Retrieved so a job we stopped waiting for does not log "never retrieved"
+
+async def _run_hash_job(func, *args):
+    try:
+        await asyncio.wait_for(_hash_slots.acquire(), timeout=settings.PASSWORD_HASH_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent password operations, please retry later"
+        )
+    # The slot is held until the hashing thread finishes, not just while we wait for it,
+    # so a timed-out job still counts against the bound
+    future = asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    future.add_done_callback(_release_hash_slot)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout=settings.PASSWORD_HASH_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Password operation timed out, please retry later"
+        )
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hash a password on the password hashing pool.
+
+    Args:
+        password: The plain password to hash
+
+    Returns:
+        str: The hashed password
+    """
+    return await _run_hash_job(hash_password, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password on the password hashing pool.
+
+    Args:
+        plain_password: The password provided by the user
+        hashed_password: The stored hashed password
+
+    Returns:
+        Tuple[bool, Optional[str]]: Whether the password matches, and a fresh
+        hash to store when the stored one uses outdated settings
+    """
+    def verify():
+        try:
+            return pwd_context.verify_and_update(plain_password, hashed_password)
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Password verification error: {str(e)}"
+            )
+    return await _run_hash_job(verify)
+
 def create_token(user_id: int, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT token for a user.
@@ -81,6 +163,19 @@ def create_token(user_id: int, expires_delta: Optional[timedelta] = None) -> str
             detail=f"Token creation error: {str(e)}"
         )
 
+def rotate_secret(new_secret: str):
+    """
+    Switch the signing secret and drop every cached verification.
+    """
+    global SECRET_KEY
+    SECRET_KEY = new_secret
+    _flush_token_cache()
+
+def _flush_token_cache():
+    global _token_cache_secret
+    token_cache.clear()
+    _token_cache_secret = SECRET_KEY
+
 def decode_token(token: str) -> dict:
     """
     Decode and verify a JWT token.
@@ -94,8 +189,19 @@ def decode_token(token: str) -> dict:
     Raises:
         HTTPException: If token is invalid or expired
     """
+    if SECRET_KEY != _token_cache_secret:
+        _flush_token_cache()
+
+    cache_key = hashlib.sha256(token.encode("utf-8")).digest()
+    cached = token_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        exp = payload.get("exp")
+        if exp is not None:
+            token_cache.set(cache_key, dict(payload), ttl_seconds=float(exp) - time.time())
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(
@@ -103,7 +209,7 @@ def decode_token(token: str) -> dict:
             detail="Token has expired",
             headers={"WWW-Authenticate": "Bearer"}
         )
-    except jwt.InvalidTokenError:
+    except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
@@ -19,29 +19,58 @@ SET time_zone = "+00:00";
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `ai_jobs`
+--
+
+CREATE TABLE `ai_jobs` (
+  `id` char(36) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `kind` varchar(20) NOT NULL,
+  `status` varchar(20) NOT NULL DEFAULT 'queued',
+  `params` text DEFAULT NULL,
+  `filename` varchar(255) DEFAULT NULL,
+  `content_type` varchar(255) DEFAULT NULL,
+  `file_path` varchar(512) DEFAULT NULL,
+  `spool_host` varchar(255) DEFAULT NULL,
+  `webhook_url` varchar(2048) DEFAULT NULL,
+  `result` mediumtext DEFAULT NULL,
+  `error` text DEFAULT NULL,
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `created_at` datetime DEFAULT NULL,
+  `started_at` datetime DEFAULT NULL,
+  `heartbeat_at` datetime DEFAULT NULL,
+  `finished_at` datetime DEFAULT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `api_call_logs`
 --
 
 CREATE TABLE `api_call_logs` (
-  `id` int(11) NOT NULL,
-  `endpoint` text DEFAULT NULL,
+  `id` bigint(20) NOT NULL,
+  `endpoint` varchar(255) NOT NULL,
   `method` varchar(50) DEFAULT NULL,
-  `request_time` timestamp NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
-  `response_time` timestamp NULL DEFAULT '0000-00-00 00:00:00',
+  `request_time` datetime NOT NULL DEFAULT current_timestamp(),
+  `response_time` datetime DEFAULT NULL,
   `duration_ms` int(11) DEFAULT NULL,
   `status_code` int(11) DEFAULT NULL,
   `client_ip` text DEFAULT NULL,
   `user_agent` text DEFAULT NULL,
   `file_type` text DEFAULT NULL,
   `filename` text DEFAULT NULL,
-  `file_size_bytes` int(11) DEFAULT NULL,
-  `response_success` int(11) DEFAULT NULL,
+  `file_size_bytes` bigint(20) DEFAULT NULL,
+  `file_sha256` char(64) DEFAULT NULL,
+  `response_success` tinyint(1) DEFAULT NULL,
   `error_message` text DEFAULT NULL,
   `user_id` int(11) DEFAULT NULL,
-  `request_id` text DEFAULT NULL,
+  `request_id` varchar(36) DEFAULT NULL,
   `request_data` text DEFAULT NULL,
-  `response_data` text DEFAULT NULL
+  `response_data` text DEFAULT NULL,
+  `response_size_bytes` bigint(20) DEFAULT NULL,
+  `response_sha256` char(64) DEFAULT NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
 -- --------------------------------------------------------
@@ -53,7 +82,7 @@ CREATE TABLE `api_call_logs` (
 CREATE TABLE `api_usage` (
   `id` int(11) NOT NULL,
   `user_id` int(11) NOT NULL,
-  `period` varchar(6) NOT NULL,
+  `period` varchar(7) NOT NULL,
   `receipt_scans` int(11) NOT NULL,
   `invoice_scans` int(11) NOT NULL,
   `any_scans` int(11) NOT NULL,
@@ -63,6 +92,19 @@ CREATE TABLE `api_usage` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `api_usage_monthly`
+--
+
+CREATE TABLE `api_usage_monthly` (
+  `month` char(7) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `endpoint` varchar(255) NOT NULL,
+  `call_count` int(11) NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `subscriptions`
 --
@@ -116,7 +158,8 @@ INSERT INTO `users` (`id`, `username`, `password`, `email`, `created_at`) VALUES
 CREATE TABLE `user_subscription` (
   `id` int(11) NOT NULL,
   `user_id` int(11) NOT NULL,
-  `plan_id` int(11) NOT NULL,
+  `subscription_id` int(11) NOT NULL,
+  `amount` double DEFAULT NULL,
   `date_from` date NOT NULL,
   `date_to` date NOT NULL,
   `subscribed_at` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp()
@@ -126,17 +169,36 @@ CREATE TABLE `user_subscription` (
 -- Indexes for dumped tables
 --
 
+--
+-- Indexes for table `ai_jobs`
+--
+ALTER TABLE `ai_jobs`
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `ix_ai_jobs_status_created` (`status`, `created_at`),
+  ADD KEY `ix_ai_jobs_host_status` (`spool_host`, `status`),
+  ADD KEY `ix_ai_jobs_user_created` (`user_id`, `created_at`);
+
 --
 -- Indexes for table `api_call_logs`
 --
 ALTER TABLE `api_call_logs`
-  ADD PRIMARY KEY (`id`);
+  ADD PRIMARY KEY (`id`, `request_time`),
+  ADD KEY `ix_api_call_logs_user_time` (`user_id`, `request_time`),
+  ADD KEY `ix_api_call_logs_endpoint_time` (`endpoint`, `request_time`);
 
 --
 -- Indexes for table `api_usage`
 --
 ALTER TABLE `api_usage`
-  ADD PRIMARY KEY (`id`);
+  ADD PRIMARY KEY (`id`),
+  ADD UNIQUE KEY `uq_api_usage_user_period` (`user_id`, `period`);
+
+--
+-- Indexes for table `api_usage_monthly`
+--
+ALTER TABLE `api_usage_monthly`
+  ADD PRIMARY KEY (`month`, `user_id`, `endpoint`),
+  ADD KEY `ix_api_usage_monthly_user_month` (`user_id`, `month`);
 
 --
 -- Indexes for table `subscriptions`
@@ -154,7 +216,8 @@ ALTER TABLE `users`
 -- Indexes for table `user_subscription`
 --
 ALTER TABLE `user_subscription`
-  ADD PRIMARY KEY (`id`);
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `ix_user_subscription_user_dates` (`user_id`, `date_from`, `date_to`);
 
 --
 -- AUTO_INCREMENT for dumped tables
@@ -164,7 +227,7 @@ ALTER TABLE `user_subscription`
 -- AUTO_INCREMENT for table `api_call_logs`
 --
 ALTER TABLE `api_call_logs`
-  MODIFY `id` int(11) NOT NULL AUTO_INCREMENT;
+  MODIFY `id` bigint(20) NOT NULL AUTO_INCREMENT;
 
 --
 -- AUTO_INCREMENT for table `api_usage`
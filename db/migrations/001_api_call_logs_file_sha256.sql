@@ -0,0 +1,3 @@
+-- Upload digest recorded by the streaming request capture (REQUEST_CAPTURE_HASH_FILES)
+ALTER TABLE `api_call_logs`
+  ADD COLUMN `file_sha256` char(64) DEFAULT NULL AFTER `file_size_bytes`;
@@ -0,0 +1,4 @@
+-- Response size and digest recorded by the bounded response capture (RESPONSE_CAPTURE_MODE)
+ALTER TABLE `api_call_logs`
+  ADD COLUMN `response_size_bytes` int(11) DEFAULT NULL AFTER `response_data`,
+  ADD COLUMN `response_sha256` char(64) DEFAULT NULL AFTER `response_size_bytes`;
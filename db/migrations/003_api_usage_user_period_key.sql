@@ -0,0 +1,4 @@
+-- Periods are stored as YYYY-MM, and usage flushes UPSERT on (user_id, period)
+ALTER TABLE `api_usage`
+  MODIFY `period` varchar(7) NOT NULL,
+  ADD UNIQUE KEY `uq_api_usage_user_period` (`user_id`, `period`);
@@ -0,0 +1,18 @@
+-- Monthly rollup behind /dev/users_usage_monthly, maintained by the api_call_logs writer
+CREATE TABLE IF NOT EXISTS `api_usage_monthly` (
+  `month` char(7) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `endpoint` varchar(255) NOT NULL,
+  `call_count` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`month`, `user_id`, `endpoint`),
+  KEY `ix_api_usage_monthly_user_month` (`user_id`, `month`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- One-off backfill from existing logs. Run it before deploying the writer
+-- that maintains the rollup, otherwise rows logged in between are counted twice.
+INSERT INTO `api_usage_monthly` (`month`, `user_id`, `endpoint`, `call_count`)
+SELECT DATE_FORMAT(`request_time`, '%Y-%m'), `user_id`, LEFT(`endpoint`, 255), COUNT(*)
+FROM `api_call_logs`
+WHERE `user_id` IS NOT NULL AND `request_time` IS NOT NULL
+GROUP BY DATE_FORMAT(`request_time`, '%Y-%m'), `user_id`, LEFT(`endpoint`, 255)
+ON DUPLICATE KEY UPDATE `call_count` = VALUES(`call_count`);
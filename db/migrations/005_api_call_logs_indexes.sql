@@ -0,0 +1,19 @@
+-- Bring api_call_logs in line with db.models.ApiCallLog and prepare it for
+-- monthly RANGE partitioning (run `python -m db.partitions init` afterwards).
+-- Partitioned tables need the partition column in every unique key, hence the
+-- (id, request_time) primary key. This rebuilds the table; run it off-peak.
+UPDATE `api_call_logs` SET `request_time` = COALESCE(`response_time`, NOW()) WHERE `request_time` IS NULL;
+
+ALTER TABLE `api_call_logs`
+  MODIFY `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  MODIFY `endpoint` varchar(255) NOT NULL,
+  MODIFY `request_time` datetime NOT NULL DEFAULT current_timestamp(),
+  MODIFY `response_time` datetime DEFAULT NULL,
+  MODIFY `file_size_bytes` bigint(20) DEFAULT NULL,
+  MODIFY `response_success` tinyint(1) DEFAULT NULL,
+  MODIFY `request_id` varchar(36) DEFAULT NULL,
+  MODIFY `response_size_bytes` bigint(20) DEFAULT NULL,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id`, `request_time`),
+  ADD KEY `ix_api_call_logs_user_time` (`user_id`, `request_time`),
+  ADD KEY `ix_api_call_logs_endpoint_time` (`endpoint`, `request_time`);
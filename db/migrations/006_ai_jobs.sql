@@ -0,0 +1,22 @@
+-- Asynchronous document parse jobs (/ai/jobs)
+CREATE TABLE IF NOT EXISTS `ai_jobs` (
+  `id` char(36) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `kind` varchar(20) NOT NULL,
+  `status` varchar(20) NOT NULL DEFAULT 'queued',
+  `params` text DEFAULT NULL,
+  `filename` varchar(255) DEFAULT NULL,
+  `content_type` varchar(255) DEFAULT NULL,
+  `file_path` varchar(512) DEFAULT NULL,
+  `webhook_url` varchar(2048) DEFAULT NULL,
+  `result` mediumtext DEFAULT NULL,
+  `error` text DEFAULT NULL,
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `created_at` datetime DEFAULT NULL,
+  `started_at` datetime DEFAULT NULL,
+  `heartbeat_at` datetime DEFAULT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_ai_jobs_status_created` (`status`, `created_at`),
+  KEY `ix_ai_jobs_user_created` (`user_id`, `created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
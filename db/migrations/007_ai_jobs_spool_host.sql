@@ -0,0 +1,4 @@
+-- Host whose local JOB_SPOOL_DIR holds a job's upload; NULL when the spool is shared (JOB_SPOOL_SHARED)
+ALTER TABLE `ai_jobs`
+  ADD COLUMN `spool_host` varchar(255) DEFAULT NULL AFTER `file_path`,
+  ADD KEY `ix_ai_jobs_host_status` (`spool_host`, `status`);
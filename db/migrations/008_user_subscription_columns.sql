@@ -0,0 +1,6 @@
+-- Match db.models.UserSubscription: the plan column is subscription_id, and subscriptions carry an amount.
+-- Without this the usage entitlement refresh fails and quotas are never enforced.
+ALTER TABLE `user_subscription`
+  CHANGE `plan_id` `subscription_id` int(11) NOT NULL,
+  ADD COLUMN `amount` double DEFAULT NULL AFTER `subscription_id`,
+  ADD KEY `ix_user_subscription_user_dates` (`user_id`, `date_from`, `date_to`);
@@ -1,5 +1,6 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, Date, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, CHAR, Text, Boolean, ForeignKey, Float, Date, DateTime, UniqueConstraint, Index
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from datetime import datetime
 
 Base = declarative_base()
@@ -45,6 +46,8 @@ class UserSubscription(Base):
 
 class ApiUsage(Base):
     __tablename__ = "api_usage"
+    # One row per user and month; usage flushes UPSERT against this key
+    __table_args__ = (UniqueConstraint("user_id", "period", name="uq_api_usage_user_period"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -61,9 +64,83 @@ class ApiUsage(Base):
 
 
 class ApiCallLog(Base):
+    """
+    One row per request, written in batches by services.log_writer.
+
+    The table is RANGE partitioned by month on request_time (see
+    db/partitions.py), so request_time is part of the primary key and
+    user_id carries no foreign key: MySQL allows neither a unique key
+    without the partition column nor foreign keys on partitioned tables.
+    """
     __tablename__ = "api_call_logs"
-
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    __table_args__ = (
+        Index("ix_api_call_logs_user_time", "user_id", "request_time"),
+        Index("ix_api_call_logs_endpoint_time", "endpoint", "request_time"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    request_time = Column(DateTime, primary_key=True, default=datetime.utcnow)
+    user_id = Column(Integer, nullable=True)
     endpoint = Column(String(255), nullable=False)
-    request_time = Column(DateTime, default=datetime.utcnow)
+    method = Column(String(50))
+    response_time = Column(DateTime)
+    duration_ms = Column(Integer)
+    status_code = Column(Integer)
+    client_ip = Column(Text)
+    user_agent = Column(Text)
+    file_type = Column(Text)
+    filename = Column(Text)
+    file_size_bytes = Column(BigInteger)
+    file_sha256 = Column(CHAR(64))
+    response_success = Column(Boolean)
+    error_message = Column(Text)
+    request_id = Column(String(36))
+    request_data = Column(Text)
+    response_data = Column(Text)
+    response_size_bytes = Column(BigInteger)
+    response_sha256 = Column(CHAR(64))
+
+
+class ApiUsageMonthly(Base):
+    """
+    Call counts per month, user and endpoint, incremented by the
+    api_call_logs writer so reports never scan the log table.
+    """
+    __tablename__ = "api_usage_monthly"
+    __table_args__ = (Index("ix_api_usage_monthly_user_month", "user_id", "month"),)
+
+    month = Column(String(7), primary_key=True)  # Format: "YYYY-MM"
+    user_id = Column(Integer, primary_key=True)
+    endpoint = Column(String(255), primary_key=True)
+    call_count = Column(Integer, nullable=False, default=0)
+
+
+class AiJob(Base):
+    """
+    Document parse submitted through /ai/jobs and run by services.jobs.
+    status: queued -> running -> succeeded | failed
+    """
+    __tablename__ = "ai_jobs"
+    __table_args__ = (
+        Index("ix_ai_jobs_status_created", "status", "created_at"),
+        Index("ix_ai_jobs_user_created", "user_id", "created_at"),
+        Index("ix_ai_jobs_host_status", "spool_host", "status"),
+    )
+
+    id = Column(CHAR(36), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    kind = Column(String(20), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")
+    params = Column(Text)  # JSON: custom_fields / positions
+    filename = Column(String(255))
+    content_type = Column(String(255))
+    file_path = Column(String(512))
+    spool_host = Column(String(255))  # Host whose local spool holds file_path; NULL on shared storage
+    webhook_url = Column(String(2048))
+    result = Column(MEDIUMTEXT)
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
@@ -1,9 +1,13 @@
 # 3. db/mysql.py
+import asyncio
 import os
 from dotenv import load_dotenv
 from sqlalchemy import MetaData, Table, insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import Insert
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from typing import Dict, List
 
 # Load environment variables
 load_dotenv()
@@ -24,6 +28,13 @@ AsyncSessionLocal = sessionmaker(
     autoflush=False,
 )
 
+# MySQL error code for "Deadlock found when trying to get lock"; the transaction was rolled back
+ER_LOCK_DEADLOCK = 1213
+
+def is_deadlock(exc: BaseException) -> bool:
+    args = getattr(exc.orig, "args", ()) if isinstance(exc, DBAPIError) else ()
+    return bool(args) and args[0] == ER_LOCK_DEADLOCK
+
 # 3. 'get_db' is now an async generator
 async def get_db() -> AsyncSession:
     """
@@ -35,6 +46,53 @@ async def get_db() -> AsyncSession:
         finally:
             await db.close()
 
+class TableRegistry:
+    """
+    Reflects tables once and hands out the cached Table objects and prebuilt
+    INSERT statements, so inserts never hit information_schema per call.
+    """
+
+    def __init__(self):
+        self.metadata = MetaData()
+        self._tables: Dict[str, Table] = {}
+        self._insert_stmts: Dict[str, Insert] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self, table_names: List[str]):
+        """
+        Reflect the given tables in one pass. Call at application startup.
+        """
+        async with self._lock:
+            missing = [name for name in table_names if name not in self._tables]
+            if not missing:
+                return
+            async with engine.connect() as conn:
+                await conn.run_sync(
+                    lambda sync_conn: self.metadata.reflect(bind=sync_conn, only=missing)
+                )
+            for name in missing:
+                table = self.metadata.tables[name]
+                self._tables[name] = table
+                self._insert_stmts[name] = insert(table)
+
+    async def get(self, table_name: str) -> Table:
+        table = self._tables.get(table_name)
+        if table is None:
+            # Tables not preloaded at startup are reflected on first use
+            await self.load([table_name])
+            table = self._tables[table_name]
+        return table
+
+    async def insert_stmt(self, table_name: str) -> Insert:
+        stmt = self._insert_stmts.get(table_name)
+        if stmt is None:
+            await self.load([table_name])
+            stmt = self._insert_stmts[table_name]
+        return stmt
+
+
+table_registry = TableRegistry()
+
 # 4. 'insert_row' is now an async function and accepts the session
 async def insert_row(db: AsyncSession, table_name: str, values: dict):
     """
@@ -45,16 +103,24 @@ async def insert_row(db: AsyncSession, table_name: str, values: dict):
         table_name (str): Name of the table to insert into.
         values (dict): Dictionary of column-value pairs.
     """
-    # Note: Reflecting the table on every call is inefficient.
-    # It's better to define your table models elsewhere and import them.
-    # But to keep your logic, we do it here.
-    async with engine.connect() as conn:
-        metadata = MetaData()
-        table = await conn.run_sync(
-            lambda sync_conn: Table(table_name, metadata, autoload_with=sync_conn)
-        )
-
-    stmt = insert(table).values(values)
-    result = await db.execute(stmt)
+    stmt = await table_registry.insert_stmt(table_name)
+    result = await db.execute(stmt.values(values))
     await db.commit()
-    return result.lastrowid
\ No newline at end of file
+    return result.lastrowid
+
+async def insert_rows(db: AsyncSession, table_name: str, rows: List[dict], commit: bool = True):
+    """
+    Insert many rows into a given table in one executemany round trip.
+
+    Args:
+        db (AsyncSession): The database session.
+        table_name (str): Name of the table to insert into.
+        rows (List[dict]): Column-value dictionaries, all with the same keys.
+        commit (bool): Commit afterwards; pass False to keep the transaction open.
+    """
+    if not rows:
+        return
+    stmt = await table_registry.insert_stmt(table_name)
+    await db.execute(stmt, rows)
+    if commit:
+        await db.commit()
\ No newline at end of file
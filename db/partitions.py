@@ -0,0 +1,178 @@
+"""
+Monthly RANGE partitioning and retention for api_call_logs.
+
+Run from the project root, e.g. daily from cron:
+
+    python -m db.partitions init       # one-off, after migration 005
+    python -m db.partitions maintain   # add upcoming months, expire old ones
+
+Partitions are named pYYYYMM and hold that month's rows; p_future
+(MAXVALUE) is kept empty by always creating LOG_PARTITIONS_AHEAD months in
+advance, so splitting it is a metadata-only operation. Expired months are
+removed with DROP PARTITION (or first swapped out to an archive table when
+LOG_ARCHIVE_EXPIRED is set) instead of row-by-row DELETEs.
+"""
+import asyncio
+import logging
+import re
+import sys
+from datetime import date
+from typing import List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from core.config import settings
+from db.mysql import engine
+
+logger = logging.getLogger(__name__)
+
+TABLE = "api_call_logs"
+FUTURE = "p_future"
+_MONTH_PARTITION = re.compile(r"^p(\d{4})(\d{2})$")
+
+
+def _add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"p{month:%Y%m}"
+
+
+def _partition_clause(month: date) -> str:
+    return f"PARTITION {_partition_name(month)} VALUES LESS THAN ('{_add_months(month, 1):%Y-%m-%d}')"
+
+
+async def _partition_months(conn: AsyncConnection) -> Optional[List[date]]:
+    """
+    Months that have a partition, oldest first; None if the table is not partitioned.
+    """
+    rows = (await conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+    ), {"table": TABLE})).scalars().all()
+    if not rows or rows == [None]:
+        return None
+    months = []
+    for name in rows:
+        match = _MONTH_PARTITION.match(name or "")
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+async def init_partitions(conn: AsyncConnection, months_ahead: int):
+    """
+    Partition the table by month, from its oldest row up to `months_ahead`
+    months from now. Rebuilds the table once; a no-op if already partitioned.
+    """
+    if await _partition_months(conn) is not None:
+        logger.info(f"{TABLE} is already partitioned")
+        return
+
+    oldest = (await conn.execute(text(f"SELECT MIN(request_time) FROM {TABLE}"))).scalar()
+    this_month = date.today().replace(day=1)
+    first = oldest.date().replace(day=1) if oldest else this_month
+    last = _add_months(this_month, months_ahead)
+
+    clauses = []
+    month = first
+    while month <= last:
+        clauses.append(_partition_clause(month))
+        month = _add_months(month, 1)
+    clauses.append(f"PARTITION {FUTURE} VALUES LESS THAN (MAXVALUE)")
+
+    await conn.execute(text(
+        f"ALTER TABLE {TABLE} PARTITION BY RANGE COLUMNS(request_time) ({', '.join(clauses)})"
+    ))
+    logger.info(f"Partitioned {TABLE} into {len(clauses)} partitions")
+
+
+async def add_future_partitions(conn: AsyncConnection, months_ahead: int) -> List[str]:
+    months = await _partition_months(conn)
+    if months is None:
+        raise RuntimeError(f"{TABLE} is not partitioned, run `python -m db.partitions init` first")
+
+    this_month = date.today().replace(day=1)
+    month = _add_months(months[-1], 1) if months else this_month
+    target = _add_months(this_month, months_ahead)
+    added = []
+    while month <= target:
+        await conn.execute(text(
+            f"ALTER TABLE {TABLE} REORGANIZE PARTITION {FUTURE} INTO "
+            f"({_partition_clause(month)}, PARTITION {FUTURE} VALUES LESS THAN (MAXVALUE))"
+        ))
+        added.append(_partition_name(month))
+        month = _add_months(month, 1)
+    return added
+
+
+async def _has_rows(conn: AsyncConnection, source: str) -> bool:
+    return (await conn.execute(text(f"SELECT 1 FROM {source} LIMIT 1"))).first() is not None
+
+
+async def expire_partitions(conn: AsyncConnection, retention_months: int, archive: bool = False) -> List[str]:
+    """
+    Remove partitions for months older than `retention_months` (the current
+    month counts as one). With `archive`, each one is first exchanged into
+    its own api_call_logs_archive_pYYYYMM table.
+
+    Safe to re-run after a crash between exchange and drop: a partition is
+    only exchanged while it has rows and its archive table has none, so
+    archived rows are never swapped back in and dropped. A month whose
+    partition and archive table both hold rows is left alone.
+    """
+    months = await _partition_months(conn) or []
+    cutoff = _add_months(date.today().replace(day=1), -(retention_months - 1))
+    expired = []
+    for month in months:
+        if month >= cutoff:
+            break
+        name = _partition_name(month)
+        if archive:
+            archive_table = f"{TABLE}_archive_{name}"
+            exists = (await conn.execute(text(
+                "SELECT COUNT(*) FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+            ), {"table": archive_table})).scalar()
+            if not exists:
+                await conn.execute(text(f"CREATE TABLE {archive_table} LIKE {TABLE}"))
+                await conn.execute(text(f"ALTER TABLE {archive_table} REMOVE PARTITIONING"))
+            if await _has_rows(conn, f"{TABLE} PARTITION ({name})"):
+                if exists and await _has_rows(conn, archive_table):
+                    logger.error(f"{name} and {archive_table} both hold rows; skipping, resolve by hand")
+                    continue
+                await conn.execute(text(f"ALTER TABLE {TABLE} EXCHANGE PARTITION {name} WITH TABLE {archive_table}"))
+        await conn.execute(text(f"ALTER TABLE {TABLE} DROP PARTITION {name}"))
+        expired.append(name)
+    return expired
+
+
+async def maintain():
+    async with engine.connect() as conn:
+        # DDL commits implicitly in MySQL; autocommit keeps SQLAlchemy from wrapping it in a transaction
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        added = await add_future_partitions(conn, settings.LOG_PARTITIONS_AHEAD)
+        expired = await expire_partitions(conn, settings.LOG_RETENTION_MONTHS, settings.LOG_ARCHIVE_EXPIRED)
+    logger.info(f"{TABLE}: added {added or 'none'}, expired {expired or 'none'}")
+
+
+async def init():
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await init_partitions(conn, settings.LOG_PARTITIONS_AHEAD)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    commands = {"init": init, "maintain": maintain}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit(f"usage: python -m db.partitions {{{'|'.join(commands)}}}")
+
+    async def run(command):
+        try:
+            await command()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run(commands[sys.argv[1]]))
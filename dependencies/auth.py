@@ -1,35 +1,71 @@
+from dataclasses import dataclass
 from fastapi import Depends, Header, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from db.mysql import get_db
 from db.models import User
 import os
+from core.cache import TTLCache
+from core.config import settings
 from core.security import decode_token
 from jose import JWTError
 
 security = HTTPBearer(auto_error=True)  # This enables Swagger integration
 
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Lightweight authenticated user, safe to cache across requests
+    (unlike an ORM instance bound to a session).
+    """
+    id: int
+    username: str
+
+
+# Per-worker cache of user id -> Principal; entries expire after the TTL
+# so edits made through another worker are picked up eventually.
+principal_cache = TTLCache(
+    max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
+
+
+def invalidate_principal(user_id: int):
+    principal_cache.pop(int(user_id))
+
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
-) -> User:
+    db: AsyncSession = Depends(get_db),
+) -> Principal:
     token = credentials.credentials
     try:
         payload = decode_token(token)
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        user_id = int(user_id)
+
+        principal = principal_cache.get(user_id)
+        if principal is not None:
+            return principal
+
+        result = await db.execute(select(User.id, User.username).where(User.id == user_id))
+        row = result.first()
+        if not row:
             raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except JWTError:
+        principal = Principal(id=row.id, username=row.username)
+        principal_cache.set(user_id, principal)
+        return principal
+    except (JWTError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 # Middleware-safe user injector
 async def inject_user_into_request(
     request: Request, 
-    user: User = Depends(get_current_user)
-) -> User:
+    user: Principal = Depends(get_current_user)
+) -> Principal:
     request.state.user = user
-    return user
\ No newline at end of file
+    return user
@@ -0,0 +1,14 @@
+from fastapi import Depends
+from dependencies.auth import Principal, inject_user_into_request
+from services.usage import usage_accountant
+
+
+def require_quota(counter: str):
+    """
+    Route dependency that rejects the call with a 429 once the user's plan
+    limit for `counter` is reached this month. Answered from memory only.
+    """
+    async def dependency(user: Principal = Depends(inject_user_into_request)) -> Principal:
+        usage_accountant.check(user.id, counter)
+        return user
+    return dependency
@@ -7,6 +7,18 @@ from fastapi.middleware.cors import CORSMiddleware
 from dependencies.dev_auth import verify_dev_token
 from api.routes import auth, dev, ai
 from utils import add_logging_middleware
+from services.log_writer import api_call_log_writer
+from db.mysql import table_registry
+from services.usage import usage_accountant
+from services.jobs import job_runner
+from services.preprocess import shutdown_pool
+from services.providers import model_router
+from middleware.upload_limit import UploadLimitMiddleware
+from middleware.admission import AdmissionControlMiddleware
+from services.admission import admission_controller
+import logging
+
+logger = logging.getLogger(__name__)
 
 def custom_openapi():
     if app.openapi_schema:
@@ -38,12 +50,41 @@ def custom_openapi():
     return app.openapi_schema
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await table_registry.load(["api_call_logs"])
+    except Exception as e:
+        # Not fatal: the registry reflects lazily on first insert
+        logger.warning(f"Table metadata preload failed: {e}")
+    api_call_log_writer.start()
+    # Fails startup if entitlements cannot be loaded, rather than serving without quotas
+    await usage_accountant.start()
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    # Flush pending usage counters and log rows before the worker exits
+    await usage_accountant.stop()
+    await api_call_log_writer.stop()
+    shutdown_pool()
+    await model_router.aclose()
+
+
 API_ROOT_PATH = os.getenv("API_ROOT_PATH")
 app = FastAPI(
-    root_path=API_ROOT_PATH
+    root_path=API_ROOT_PATH,
+    lifespan=lifespan
 )
 
 
+# Added before the logging middleware so shed requests and rejected uploads are still logged
+if admission_controller is not None:
+    app.add_middleware(AdmissionControlMiddleware, controller=admission_controller)
+app.add_middleware(UploadLimitMiddleware)
+add_logging_middleware(app)
+
+# Added last so it is outermost: 503 sheds and 413 rejections carry CORS headers,
+# and preflight OPTIONS are answered here without touching the gates
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -53,8 +94,6 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-add_logging_middleware(app)
 app.include_router(auth.router, prefix="/auth")
 
 app.include_router(ai.router, prefix="/ai")
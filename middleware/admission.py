@@ -0,0 +1,45 @@
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from fastapi import status
+from services.admission import AdmissionController, AdmissionRejected
+
+
+class AdmissionControlMiddleware:
+    """
+    Pure ASGI middleware that admits requests through the per-endpoint gates
+    of an AdmissionController before the body is read. Requests over budget
+    get a fast 503 with Retry-After instead of piling up (with their
+    uploads) behind a slow upstream. Paths without a gate pass straight
+    through. A request holds its slot until its response, streamed or not,
+    has been sent, so gates count whole HTTP requests (upload time
+    included) rather than model calls; those are bounded separately by the
+    providers' ModelCallLimiter.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        path = scope["path"]
+        route_path = path[len(root_path):] if root_path and path.startswith(root_path) else path
+        gate = self.controller.gate_for(route_path)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            async with gate.admit():
+                await self.app(scope, receive, send)
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                {"detail": e.detail},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
@@ -0,0 +1,110 @@
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from core.config import settings
+from middleware.request_capture import RequestCapture, SKIP_PREFIXES
+from middleware.response_capture import ResponseCapture, parse_capture_rules, resolve_capture_mode, validate_capture_mode
+from services.log_writer import api_call_log_writer
+
+
+class ApiLoggingMiddleware:
+    """
+    Pure ASGI middleware that records one api_call_logs row per request.
+
+    The request body is observed through a RequestCapture tee and response
+    messages are forwarded untouched through a ResponseCapture, whose mode is
+    picked per endpoint from RESPONSE_CAPTURE_RULES (first match wins) or
+    RESPONSE_CAPTURE_MODE. Only JSON bodies are copied; streaming responses
+    are never buffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.capture_rules = parse_capture_rules(settings.RESPONSE_CAPTURE_RULES)
+        # Checked here like the rule modes, so a typo fails startup instead of every JSON response
+        self.default_capture_mode = validate_capture_mode(settings.RESPONSE_CAPTURE_MODE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"].startswith(SKIP_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_time = datetime.utcnow()
+        headers = Headers(scope=scope)
+        capture = RequestCapture(
+            headers.get("content-type", ""),
+            hash_files=settings.REQUEST_CAPTURE_HASH_FILES,
+            max_json_bytes=settings.REQUEST_CAPTURE_MAX_JSON_BYTES,
+        )
+
+        status_code = 500
+        response_capture: Optional[ResponseCapture] = None
+        root_path = scope.get("root_path", "")
+        path = scope["path"]
+        route_path = path[len(root_path):] if root_path and path.startswith(root_path) else path
+
+        async def capturing_receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                capture.feed(message.get("body", b""))
+            return message
+
+        async def capturing_send(message: Message):
+            nonlocal status_code, response_capture
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = Headers(raw=message.get("headers", [])).get("content-type", "")
+                mode = "none"
+                if "application/json" in content_type:
+                    mode = resolve_capture_mode(self.capture_rules, self.default_capture_mode, route_path, status_code)
+                response_capture = ResponseCapture(mode, settings.RESPONSE_CAPTURE_MAX_BYTES)
+            elif message["type"] == "http.response.body" and response_capture is not None:
+                response_capture.feed(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            await self._log(scope, headers, capture, status_code, response_capture, request_time, duration_ms)
+
+    async def _log(
+        self,
+        scope: Scope,
+        headers: Headers,
+        capture: RequestCapture,
+        status_code: int,
+        response_capture: Optional[ResponseCapture],
+        request_time: datetime,
+        duration_ms: int,
+    ):
+        is_post = scope["method"] == "POST"
+        user = scope["state"].get("user")
+        client = scope.get("client")
+
+        await api_call_log_writer.submit({
+            "endpoint": scope["path"][:255],
+            "method": scope["method"],
+            "request_time": request_time,
+            "response_time": datetime.utcnow(),
+            "duration_ms": duration_ms,
+            "status_code": status_code,
+            "client_ip": client[0] if client else None,
+            "user_agent": headers.get("user-agent", "")[:512],
+            "file_type": capture.file_type if is_post else None,
+            "filename": capture.filename if is_post else None,
+            "file_size_bytes": capture.file_size_bytes if is_post else None,
+            "file_sha256": capture.file_sha256 if is_post else None,
+            "response_success": 200 <= status_code < 300,
+            "error_message": None,
+            "user_id": getattr(user, "id", None),
+            "request_id": str(uuid.uuid4()),
+            "request_data": capture.request_data if is_post else None,
+            "response_data": response_capture.data if response_capture else None,
+            "response_size_bytes": response_capture.size_bytes if response_capture else None,
+            "response_sha256": response_capture.sha256 if response_capture else None,
+        })
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+from typing import Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+SKIP_PREFIXES = ("/docs", "/static")
+
+
+class RequestCapture:
+    """
+    Observes request body chunks as they stream to the endpoint.
+
+    For multipart uploads the first part carrying a filename is tracked:
+    its name, content type, byte count and (optionally) SHA-256 are recorded
+    without keeping the data. JSON bodies are kept only up to
+    `max_json_bytes`. Memory use does not depend on upload size.
+    """
+
+    def __init__(self, content_type: str, hash_files: bool = False, max_json_bytes: int = 65536):
+        self.body_bytes = 0
+        self.file_type: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.file_size_bytes: Optional[int] = None
+        self.file_sha256: Optional[str] = None
+
+        self._hash_files = hash_files
+        self._hasher = None
+        self._tracking_part = False
+        self._file_seen = False
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._part_headers = {}
+
+        self._max_json_bytes = max_json_bytes
+        self._json_chunks = None
+        self._json_size = 0
+
+        self._parser = None
+        ctype, options = parse_options_header(content_type)
+        if ctype == b"multipart/form-data" and b"boundary" in options:
+            self._parser = MultipartParser(options[b"boundary"], callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            })
+        elif ctype == b"application/json":
+            self._json_chunks = []
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        self.body_bytes += len(chunk)
+
+        if self._parser is not None:
+            try:
+                self._parser.write(chunk)
+            except Exception as e:
+                # Malformed body: the endpoint will reject it, just stop observing
+                logger.debug(f"Stopped capturing multipart body: {e}")
+                self._parser = None
+
+        if self._json_chunks is not None:
+            self._json_size += len(chunk)
+            if self._json_size > self._max_json_bytes:
+                self._json_chunks = None
+            else:
+                self._json_chunks.append(chunk)
+
+    @property
+    def request_data(self) -> Optional[str]:
+        if not self._json_chunks:
+            return None
+        try:
+            return b"".join(self._json_chunks).decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+    def _on_part_begin(self):
+        self._part_headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._part_headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self):
+        if self._file_seen:
+            return
+        _, options = parse_options_header(self._part_headers.get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        if filename is None:
+            return
+
+        self._file_seen = True
+        self._tracking_part = True
+        self.filename = filename.decode("utf-8", errors="replace")
+        content_type = self._part_headers.get(b"content-type")
+        self.file_type = content_type.decode("latin-1") if content_type else None
+        self.file_size_bytes = 0
+        if self._hash_files:
+            self._hasher = hashlib.sha256()
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if not self._tracking_part:
+            return
+        self.file_size_bytes += end - start
+        if self._hasher is not None:
+            self._hasher.update(data[start:end])
+
+    def _on_part_end(self):
+        if not self._tracking_part:
+            return
+        self._tracking_part = False
+        if self._hasher is not None:
+            self.file_sha256 = self._hasher.hexdigest()
+            self._hasher = None
+
@@ -0,0 +1,97 @@
+import hashlib
+from fnmatch import fnmatchcase
+from typing import Dict, List, Optional
+
+CAPTURE_MODES = ("none", "preview", "hash", "full")
+
+# api_call_logs.response_data is a TEXT column
+FULL_CAPTURE_MAX_BYTES = 65535
+
+
+def validate_capture_mode(mode: str) -> str:
+    if mode not in CAPTURE_MODES:
+        raise ValueError(f"Unknown response capture mode: {mode}")
+    return mode
+
+
+class ResponseCaptureRule:
+    """
+    One entry of RESPONSE_CAPTURE_RULES, e.g.
+    {"path": "/auth/*", "status": "error", "mode": "full"}.
+
+    `path` is a glob matched against the route path (root_path stripped);
+    `status` is "any" (default), "error" (>= 400) or "success" (< 400).
+    """
+
+    def __init__(self, path: str, mode: str, status: str = "any"):
+        validate_capture_mode(mode)
+        if status not in ("any", "error", "success"):
+            raise ValueError(f"Unknown response capture status filter: {status}")
+        self.path = path
+        self.mode = mode
+        self.status = status
+
+    def matches(self, path: str, status_code: int) -> bool:
+        if self.status == "error" and status_code < 400:
+            return False
+        if self.status == "success" and status_code >= 400:
+            return False
+        return fnmatchcase(path, self.path)
+
+
+def resolve_capture_mode(rules: List[ResponseCaptureRule], default_mode: str, path: str, status_code: int) -> str:
+    for rule in rules:
+        if rule.matches(path, status_code):
+            return rule.mode
+    return default_mode
+
+
+def parse_capture_rules(raw_rules: List[Dict[str, str]]) -> List[ResponseCaptureRule]:
+    return [ResponseCaptureRule(**rule) for rule in raw_rules]
+
+
+class ResponseCapture:
+    """
+    Observes response body chunks with cost bounded by the capture mode:
+
+    - none:    only the byte count
+    - preview: the first `preview_bytes` bytes
+    - hash:    SHA-256 of the whole body plus the preview
+    - full:    the body up to FULL_CAPTURE_MAX_BYTES
+
+    Chunks are never concatenated beyond the cap, so work per response stays
+    linear and the stored row size stays constant.
+    """
+
+    def __init__(self, mode: str, preview_bytes: int):
+        self.mode = mode
+        self.size_bytes = 0
+        self._limit = {
+            "none": 0,
+            "preview": preview_bytes,
+            "hash": preview_bytes,
+            "full": FULL_CAPTURE_MAX_BYTES,
+        }[mode]
+        self._buffer = bytearray()
+        self._hasher = hashlib.sha256() if mode == "hash" else None
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        self.size_bytes += len(chunk)
+        if self._hasher is not None:
+            self._hasher.update(chunk)
+        room = self._limit - len(self._buffer)
+        if room > 0:
+            self._buffer += chunk[:room]
+
+    @property
+    def sha256(self) -> Optional[str]:
+        return self._hasher.hexdigest() if self._hasher is not None else None
+
+    @property
+    def data(self) -> Optional[str]:
+        if self.mode == "none":
+            return None
+        # A cut at the cap may split a multi-byte character
+        return bytes(self._buffer).decode("utf-8", errors="ignore")
@@ -0,0 +1,77 @@
+from fnmatch import fnmatchcase
+from typing import Dict, List, Union
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from core.config import settings
+
+
+class UploadLimitRule:
+    """
+    One entry of UPLOAD_LIMITS, e.g. {"path": "/ai/*/batch", "max_bytes": 209715200}.
+
+    `path` is a glob matched against the route path (root_path stripped).
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+
+
+def parse_upload_limits(raw_rules: List[Dict[str, Union[str, int]]]) -> List[UploadLimitRule]:
+    return [UploadLimitRule(**rule) for rule in raw_rules]
+
+
+class UploadLimitMiddleware:
+    """
+    Pure ASGI middleware enforcing a per-endpoint request body size limit
+    (first matching UPLOAD_LIMITS rule, else UPLOAD_MAX_BYTES).
+
+    A declared Content-Length over the limit is answered with 413 before any
+    of the body is read. Otherwise bytes are counted as the app receives them
+    and the request fails with 413 as soon as the limit is crossed, so an
+    oversize upload is never fully buffered or spooled.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.rules = parse_upload_limits(settings.UPLOAD_LIMITS)
+        self.default_max_bytes = settings.UPLOAD_MAX_BYTES
+
+    def max_bytes_for(self, path: str) -> int:
+        for rule in self.rules:
+            if fnmatchcase(path, rule.path):
+                return rule.max_bytes
+        return self.default_max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        path = scope["path"]
+        route_path = path[len(root_path):] if root_path and path.startswith(root_path) else path
+        max_bytes = self.max_bytes_for(route_path)
+        detail = f"Request body exceeds the {max_bytes} byte limit for this endpoint"
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            response = JSONResponse({"detail": detail}, status_code=status.HTTP_413_CONTENT_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised inside body parsing; FastAPI re-raises HTTPExceptions as-is
+                    raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import select, true, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.models import AiJob
+
+STALE_JOB_ERROR = "Worker stopped responding"
+
+
+def _on_host(spool_host: Optional[str]):
+    # Jobs spooled on local disk only run on the host that holds the file
+    return AiJob.spool_host == spool_host if spool_host is not None else true()
+
+
+async def create_job(db: AsyncSession, job: AiJob) -> AiJob:
+    db.add(job)
+    await db.commit()
+    return job
+
+
+async def get_job(db: AsyncSession, job_id: str) -> Optional[AiJob]:
+    return await db.get(AiJob, job_id)
+
+
+async def list_queued_job_ids(db: AsyncSession, limit: int, spool_host: Optional[str] = None) -> List[str]:
+    result = await db.execute(
+        select(AiJob.id)
+        .where(AiJob.status == "queued", _on_host(spool_host))
+        .order_by(AiJob.created_at)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def claim_job(db: AsyncSession, job_id: str, spool_host: Optional[str] = None) -> bool:
+    """
+    Atomically move a queued job to running. Only one worker, in any
+    process, can win the claim; with spool_host set, only jobs spooled on
+    that host can be claimed.
+    """
+    now = datetime.utcnow()
+    result = await db.execute(
+        update(AiJob)
+        .where(AiJob.id == job_id, AiJob.status == "queued", _on_host(spool_host))
+        .values(status="running", started_at=now, heartbeat_at=now, attempts=AiJob.attempts + 1)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def touch_job(db: AsyncSession, job_id: str):
+    await db.execute(
+        update(AiJob)
+        .where(AiJob.id == job_id, AiJob.status == "running")
+        .values(heartbeat_at=datetime.utcnow())
+    )
+    await db.commit()
+
+
+async def finish_job(db: AsyncSession, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+    await db.execute(
+        update(AiJob)
+        .where(AiJob.id == job_id)
+        .values(status=status, result=result, error=error, finished_at=datetime.utcnow())
+    )
+    await db.commit()
+
+
+async def recover_stale_jobs(db: AsyncSession, stale_seconds: float, max_attempts: int, spool_host: Optional[str] = None) -> Tuple[int, List[Row]]:
+    """
+    Requeue running jobs whose worker stopped sending heartbeats (crash or
+    restart); jobs that already used all attempts are marked failed.
+    Returns the number of jobs recovered and the failed ones (id, file_path,
+    user_id, kind), so their spool files can be removed and their quota
+    given back.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+    stale = (AiJob.status == "running") & (AiJob.heartbeat_at < cutoff) & _on_host(spool_host)
+    exhausted = await db.execute(
+        select(AiJob.id, AiJob.file_path, AiJob.user_id, AiJob.kind).where(stale, AiJob.attempts >= max_attempts)
+    )
+    exhausted = exhausted.all()
+    failed_ids = [job.id for job in exhausted]
+    failed = 0
+    if failed_ids:
+        result = await db.execute(
+            update(AiJob)
+            .where(AiJob.id.in_(failed_ids), stale)
+            .values(status="failed", error=STALE_JOB_ERROR, finished_at=datetime.utcnow())
+        )
+        failed = result.rowcount
+        if failed < len(exhausted):
+            # Some sent a heartbeat since the select; only report the ones actually failed here
+            still_failed = await db.execute(
+                select(AiJob.id).where(AiJob.id.in_(failed_ids), AiJob.status == "failed", AiJob.error == STALE_JOB_ERROR)
+            )
+            still_failed = set(still_failed.scalars())
+            exhausted = [job for job in exhausted if job.id in still_failed]
+    requeued = await db.execute(
+        update(AiJob)
+        .where(stale, AiJob.attempts < max_attempts)
+        .values(status="queued")
+    )
+    await db.commit()
+    return failed + requeued.rowcount, exhausted
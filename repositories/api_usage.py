@@ -1,58 +1,169 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from db.models import ApiCallLog, User, UserSubscription, Subscription
+from sqlalchemy import select, tuple_, Row
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.models import ApiUsage, ApiUsageMonthly, User, UserSubscription, Subscription
 from collections import defaultdict
+from datetime import date, datetime
+from typing import List, Optional
 
-def get_monthly_api_usage(db: Session):
-    # Get API call counts grouped by month, user, and endpoint
-    usage_rows = db.query(
-        ApiCallLog.user_id,
-        ApiCallLog.endpoint,
-        func.date_format(ApiCallLog.request_time, '%Y-%m').label('month'),
-        func.count().label('call_count')
-    ).group_by(
-        ApiCallLog.user_id,
-        ApiCallLog.endpoint,
-        'month'
-    ).all()
-
-    # Get user info in bulk
-    users = db.query(User).all()
-    user_map = {u.id: u for u in users}
-
-    # Get active subscriptions (latest date_to)
+async def get_monthly_api_usage(
+    db: AsyncSession,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    user_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> dict:
+    """
+    Monthly call counts per user and endpoint, read from the
+    api_usage_monthly rollup. Pages over (month, user) pairs, newest month
+    first, so one user's endpoints never straddle two pages; `limit` None
+    returns every pair.
+    """
+    filters = []
+    if month_from:
+        filters.append(ApiUsageMonthly.month >= month_from)
+    if month_to:
+        filters.append(ApiUsageMonthly.month <= month_to)
+    if user_id is not None:
+        filters.append(ApiUsageMonthly.user_id == user_id)
+
+    # One extra pair tells us whether another page exists
+    pair_rows = (await db.execute(
+        select(ApiUsageMonthly.month, ApiUsageMonthly.user_id)
+        .where(*filters)
+        .group_by(ApiUsageMonthly.month, ApiUsageMonthly.user_id)
+        .order_by(ApiUsageMonthly.month.desc(), ApiUsageMonthly.user_id)
+        .limit(limit + 1 if limit is not None else None)
+        .offset(offset)
+    )).all()
+    has_more = limit is not None and len(pair_rows) > limit
+    pairs = [(row.month, row.user_id) for row in pair_rows[:limit]]
+
+    result = defaultdict(dict)
+    if not pairs:
+        return {"months": result, "limit": limit, "offset": offset, "has_more": False}
+
+    usage_rows = (await db.execute(
+        select(ApiUsageMonthly.month, ApiUsageMonthly.user_id, ApiUsageMonthly.endpoint, ApiUsageMonthly.call_count)
+        .where(tuple_(ApiUsageMonthly.month, ApiUsageMonthly.user_id).in_(pairs))
+        .order_by(ApiUsageMonthly.month.desc(), ApiUsageMonthly.user_id, ApiUsageMonthly.endpoint)
+    )).all()
+
+    # User info and latest subscription, for the users on this page only
+    user_ids = {uid for _, uid in pairs}
+    user_map = {
+        row.id: row.username
+        for row in (await db.execute(select(User.id, User.username).where(User.id.in_(user_ids)))).all()
+    }
     subs_map = {}
-    sub_records = (
-        db.query(UserSubscription)
-        .join(Subscription)
+    sub_rows = (await db.execute(
+        select(UserSubscription.user_id, Subscription.name)
+        .join(Subscription, UserSubscription.subscription_id == Subscription.id)
+        .where(UserSubscription.user_id.in_(user_ids))
         .order_by(UserSubscription.user_id, UserSubscription.date_to.desc())
-        .all()
-    )
-    for sub in sub_records:
+    )).all()
+    for sub in sub_rows:
         if sub.user_id not in subs_map:
-            subs_map[sub.user_id] = sub.subscription.name
+            subs_map[sub.user_id] = sub.name
 
     # Organize results
-    result = defaultdict(dict)
     for row in usage_rows:
-        user = user_map.get(row.user_id)
-        if not user:
+        if row.user_id not in user_map:
             continue
 
-        month = row.month
         uid = str(row.user_id)
-
-        if uid not in result[month]:
-            result[month][uid] = {
+        if uid not in result[row.month]:
+            result[row.month][uid] = {
                 "user_id": row.user_id,
-                "username": user.username,
+                "username": user_map[row.user_id],
                 "subscription": subs_map.get(row.user_id, None),
                 "call": []
             }
 
-        result[month][uid]["call"].append({
+        result[row.month][uid]["call"].append({
             "endpoint": row.endpoint,
             "count": row.call_count
         })
 
-    return result
+    return {"months": result, "limit": limit, "offset": offset, "has_more": has_more}
+
+
+async def increment_monthly_rollup(db: AsyncSession, log_rows: List[dict]):
+    """
+    Fold a batch of api_call_logs rows into api_usage_monthly. Does not
+    commit, so it can share the transaction that inserts the log rows.
+    """
+    counts = defaultdict(int)
+    for row in log_rows:
+        if row.get("user_id") is None:
+            continue
+        counts[(row["request_time"].strftime("%Y-%m"), row["user_id"], row["endpoint"][:255])] += 1
+    if not counts:
+        return
+
+    table = ApiUsageMonthly.__table__
+    # Rows in primary key order, so concurrent flushes lock overlapping keys in the same order
+    stmt = mysql_insert(table).values([
+        {"month": month, "user_id": uid, "endpoint": endpoint, "call_count": count}
+        for (month, uid, endpoint), count in sorted(counts.items())
+    ])
+    stmt = stmt.on_duplicate_key_update(call_count=table.c.call_count + stmt.inserted.call_count)
+    await db.execute(stmt)
+
+
+async def load_active_entitlements(db: AsyncSession, today: date) -> List[Row]:
+    """
+    Current subscription per user with its limits; when a user has several
+    active subscriptions the one ending last comes first.
+    """
+    result = await db.execute(
+        select(
+            UserSubscription.user_id,
+            Subscription.id.label("subscription_id"),
+            Subscription.name.label("subscription_name"),
+            Subscription.receipt_scans,
+            Subscription.invoice_scans,
+            Subscription.any_scans,
+        )
+        .join(Subscription, UserSubscription.subscription_id == Subscription.id)
+        .where(UserSubscription.date_from <= today, UserSubscription.date_to >= today)
+        .order_by(UserSubscription.user_id, UserSubscription.date_to.desc())
+    )
+    return result.all()
+
+
+async def load_period_usage(db: AsyncSession, period: str) -> List[Row]:
+    result = await db.execute(
+        select(
+            ApiUsage.user_id,
+            ApiUsage.receipt_scans,
+            ApiUsage.invoice_scans,
+            ApiUsage.any_scans,
+        )
+        .where(ApiUsage.period == period)
+    )
+    return result.all()
+
+
+async def upsert_usage_increments(db: AsyncSession, rows: List[dict]):
+    """
+    Add counter increments to api_usage in one statement.
+
+    Args:
+        rows: dicts with user_id, period, receipt_scans, invoice_scans, any_scans
+    """
+    if not rows:
+        return
+    now = datetime.utcnow()
+    # Unique key order, so concurrent flushes lock overlapping rows in the same order
+    rows = sorted(rows, key=lambda row: (row["user_id"], row["period"]))
+    stmt = mysql_insert(ApiUsage.__table__).values([{**row, "created_at": now, "updated_at": now} for row in rows])
+    stmt = stmt.on_duplicate_key_update(
+        receipt_scans=ApiUsage.__table__.c.receipt_scans + stmt.inserted.receipt_scans,
+        invoice_scans=ApiUsage.__table__.c.invoice_scans + stmt.inserted.invoice_scans,
+        any_scans=ApiUsage.__table__.c.any_scans + stmt.inserted.any_scans,
+        updated_at=stmt.inserted.updated_at,
+    )
+    await db.execute(stmt)
+    await db.commit()
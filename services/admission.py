@@ -0,0 +1,102 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, Optional
+from core.config import settings
+from core.metrics import LatencyStats
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Budget for one ADMISSION_LIMITS entry: at most `max_in_flight` requests
+    run, at most `max_queue` more wait up to `queue_timeout` seconds for a
+    turn, and everything beyond that is rejected at once.
+    """
+
+    def __init__(self, path: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.path = path
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.latency = LatencyStats()
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    def retry_after(self) -> int:
+        # Rough time for the current backlog to drain, from recent request durations
+        average = self.latency.total / self.latency.count if self.latency.count else 1.0
+        backlog = self.waiting + 1
+        return min(60, max(1, math.ceil(average * backlog / self.max_in_flight)))
+
+    @asynccontextmanager
+    async def admit(self):
+        if not self._semaphore.locked():
+            # A slot is free; acquire() returns without suspending
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected("Server is at capacity for this endpoint, please retry later", self.retry_after())
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise AdmissionRejected("Timed out waiting for capacity, please retry later", self.retry_after())
+            finally:
+                self.waiting -= 1
+
+        self.in_flight += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.latency.observe(time.monotonic() - started)
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "latency": self.latency.stats(),
+        }
+
+
+class AdmissionController:
+    """Maps route paths to gates; the first matching ADMISSION_LIMITS glob wins."""
+
+    def __init__(self, raw_rules: List[Dict[str, Any]]):
+        self.gates = [AdmissionGate(**rule) for rule in raw_rules]
+
+    def gate_for(self, path: str) -> Optional[AdmissionGate]:
+        for gate in self.gates:
+            if fnmatchcase(path, gate.path):
+                return gate
+        return None
+
+    def stats(self) -> dict:
+        return {gate.path: gate.stats() for gate in self.gates}
+
+
+admission_controller = AdmissionController(settings.ADMISSION_LIMITS) if settings.ADMISSION_CONTROL_ENABLED else None
@@ -1,21 +1,26 @@
 from fastapi import File, UploadFile, HTTPException
 import json
-from google import genai
 from google.genai import types
-from typing import Optional, Dict, List
+from typing import AsyncIterator, Optional, Dict, List
 from core.config import settings
-import os
+from core.metrics import LatencyStats
+from services.providers import model_router
+from services.result_cache import parse_result_cache, make_cache_key
+from services.parser_registry import parser_registry, CompiledParser
+from services.preprocess import preprocessor, text_layer_extractor, PDF_TYPE
+from services.uploads import inspect_upload
 import logging
 import re
+import time
 
+logger = logging.getLogger(__name__)
 
-# Initialize Gemini Client
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = settings.GOOGLE_APPLICATION_CREDENTIALS
-client = genai.Client(
-    vertexai=True,
-    project=settings.GOOGLE_PROJECT_NAME,
-    location=settings.GOOGLE_PROJECT_LOCATION,
-)
+# End-to-end resume_parser latency (with positions) per extraction path
+resume_path_latency = {
+    "single_pass": LatencyStats(),
+    "single_pass_fallback": LatencyStats(),
+    "two_pass": LatencyStats(),
+}
 
 def extract_json_from_response(text: str) -> dict:
     try:
@@ -23,237 +28,157 @@ def extract_json_from_response(text: str) -> dict:
         if match:
             return json.loads(match.group())
     except Exception as e:
-        print("Error extracting JSON:", e)
+        logger.warning(f"Error extracting JSON from model response: {e!r}")
     return {}
 
 class AiService:
-    # Centralized type mapping
-    TYPE_MAP = {
-        "string": genai.types.Type.STRING,
-        "number": genai.types.Type.NUMBER,
-        "date": genai.types.Type.STRING,  # Dates as YYYY-MM-DD strings
-        "array_string": genai.types.Type.ARRAY,
-        "object": genai.types.Type.OBJECT
-    }
+    def __init__(self, cache_bypass: bool = False, user_id: Optional[int] = None):
+        # Skip the parse cache lookup for this request (the fresh result is still stored)
+        self.cache_bypass = cache_bypass
+        # Tenant whose fair share of model-call capacity this service's calls queue under
+        self.user_id = user_id
 
-    async def _parse_document(self, file: UploadFile, prompt: str, response_schema: genai.types.Schema) -> Optional[Dict]:
+    async def _generate(self, contents: List[types.Content], config: types.GenerateContentConfig, model: Optional[str] = None) -> str:
+        # The router picks Gemini or the local model for this call and falls back when one is saturated
+        return await model_router.generate(contents, config, model, tenant=self.user_id)
+
+    async def _parse_document(self, file: UploadFile, parser: CompiledParser) -> Optional[Dict]:
         try:
-            # Read file bytes
+            # Sniff and hash from the spooled upload; junk is rejected before the file is read into memory
+            upload = await inspect_upload(file)
+
+            cache_key = None
+            if parse_result_cache is not None:
+                cache_key = make_cache_key(upload.sha256, parser.cache_prompt, parser.schema_json, parser.model)
+                if self.cache_bypass:
+                    parse_result_cache.bypassed += 1
+                else:
+                    cached = await parse_result_cache.get(cache_key)
+                    if cached is not None:
+                        return cached
+
+            # Cache keys use the original upload, so a hit also skips pre-processing
             file_bytes = await file.read()
+            mime_type = upload.mime_type
+            document_text = None
+            if parser.text_layer and mime_type == PDF_TYPE and text_layer_extractor is not None:
+                document_text = await text_layer_extractor.extract(file_bytes)
+
+            if document_text is not None:
+                document_part = types.Part(text=f"Document text:\n{document_text}")
+            else:
+                if preprocessor is not None:
+                    file_bytes, mime_type = await preprocessor.process(file_bytes, mime_type, grayscale=parser.grayscale)
+                document_part = types.Part(
+                    inline_data=types.Blob(
+                        mime_type=mime_type,
+                        data=file_bytes
+                    )
+                )
+
             contents = [
                 types.Content(
                     role="user",
                     parts=[
-                        types.Part(text=prompt),
-                        types.Part(
-                            inline_data=types.Blob(
-                                mime_type=file.content_type,
-                                data=file_bytes
-                            )
-                        )
+                        types.Part(text=parser.prompt),
+                        document_part
                     ]
                 )
             ]
 
-            config = types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(thinking_budget=0),
-                response_mime_type="application/json",
-                response_schema=response_schema
-            )
-
-            response = client.models.generate_content(
-                model=settings.GOOGLE_GEMINI_MODEL,
-                contents=contents,
-                config=config,
-            )
+            response_text = await self._generate(contents, parser.config, model=parser.model)
 
-            return json.loads(response.text)
+            result = json.loads(response_text)
+            if cache_key is not None and result:
+                await parse_result_cache.set(cache_key, result)
+            return result
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Error generating content: {e}")
+            logger.warning(f"Error generating content for parser {parser.name}: {e!r}")
             return None
 
+    async def parse(self, name: str, file: UploadFile, custom_fields: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+        """Run any parser declared in the registry (services/parsers.json)."""
+        return await self._parse_document(file, parser_registry.compile(name, custom_fields))
+
     async def receipt_parser(self, image: UploadFile) -> Optional[Dict]:
-        prompt = "When generating structured data, convert all date-related fields to the format YYYY-MM-DD. If the image does NOT contain a valid receipt or invoice, leave all fields empty."
-        schema = genai.types.Schema(
-            type=genai.types.Type.OBJECT,
-            required=["invoice_date", "total_amount", "invoice_number", "merchant_name"],
-            properties={
-                "invoice_date": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                "total_amount": genai.types.Schema(type=self.TYPE_MAP["number"]),
-                "invoice_number": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                "merchant_name": genai.types.Schema(type=self.TYPE_MAP["string"]),
-            }
-        )
-        return await self._parse_document(image, prompt, schema)
+        return await self.parse("receipt", image)
 
     async def receipt_parser_1stavenue(self, image: UploadFile) -> Optional[Dict]:
-        prompt = "When generating structured data, convert all date-related fields to the format YYYY-MM-DD."
-        schema = genai.types.Schema(
-            type=genai.types.Type.OBJECT,
-            required=["invoice_date", "total_amount", "invoice_number", "merchant_name"],
-            properties={
-                "invoice_date": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                "total_amount": genai.types.Schema(type=self.TYPE_MAP["number"]),
-                "invoice_number": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                "merchant_name": genai.types.Schema(type=self.TYPE_MAP["string"]),
-            }
-        )
-        return await self._parse_document(image, prompt, schema)
-    
-    async def vclaim_parser(self, image: UploadFile, custom_fields: Optional[Dict[str, str]] = None) -> Optional[Dict]:
-        prompt = "Extract structured data from this claim-related image. Convert all date-related fields to the format YYYY-MM-DD."
+        return await self.parse("receipt_1stavenue", image)
 
-        # Sample fallback or default fields if none provided
-        custom_fields = custom_fields or {
-            "date": "date",
-            "invoice_no": "string",
-            "total_amount": "string",
-        }
+    async def vclaim_parser(self, image: UploadFile, custom_fields: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+        return await self.parse("vclaim", image, custom_fields)
 
-        prompt += "\nInclude the following fields:\n" + "\n".join(f"- {k} ({v})" for k, v in custom_fields.items())
+    async def resume_parser(self, document: UploadFile, custom_fields: Optional[Dict[str, str]] = None, positions: Optional[List[str]] = None) -> Optional[Dict]:
+        if not positions:
+            # Digitally generated PDFs go as their text layer (see parsers.json); scans fall back to the file itself
+            return await self.parse("resume", document, custom_fields)
+
+        started = time.monotonic()
+        if settings.RESUME_SINGLE_PASS:
+            resume_data = await self._resume_single_pass(document, custom_fields, positions)
+            if resume_data is not None and isinstance(resume_data.get("matched_positions"), list):
+                resume_path_latency["single_pass"].observe(time.monotonic() - started)
+                return resume_data
+
+            # Fall back to the two-call path, reusing the extraction if only the matching is missing
+            if resume_data is None:
+                await document.seek(0)
+                resume_data = await self.parse("resume", document, custom_fields)
+            if resume_data:
+                resume_data["matched_positions"] = await self._match_positions(resume_data, positions)
+            resume_path_latency["single_pass_fallback"].observe(time.monotonic() - started)
+            return resume_data
+
+        resume_data = await self.parse("resume", document, custom_fields)
+        if resume_data:
+            resume_data["matched_positions"] = await self._match_positions(resume_data, positions)
+        resume_path_latency["two_pass"].observe(time.monotonic() - started)
+        return resume_data
 
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s'
+    async def _resume_single_pass(self, document: UploadFile, custom_fields: Optional[Dict[str, str]], positions: List[str]) -> Optional[Dict]:
+        # One structured-output call returns the extraction and matched_positions together
+        parser = parser_registry.compile("resume_positions", custom_fields)
+        # The positions must reach the cache key too, or a CV cached for one list answers another
+        parser = parser.with_instructions(
+            "\n\n"
+            "Also determine which of the following job positions the candidate is best suited for, "
+            "and return them in matched_positions with a brief reason for each match:\n"
+            f"{json.dumps(positions)}"
         )
-        logging.debug(custom_fields)
-        logging.debug(prompt)
-        
-        schema = self._build_schema_from_custom_fields(custom_fields)
-
-        return await self._parse_document(image, prompt, schema)
-
-    async def resume_parser(self, document: UploadFile, custom_fields: Optional[Dict[str, str]] = None, positions: Optional[List[str]] = None) -> Optional[Dict]:
-        prompt = (
-            "Extract structured information from this resume/CV document. "
-            "Return all fields in JSON. Standard fields include:\n"
-            "- name\n- phone\n- email\n- address\n- skills\n- years_of_experience\n"
-            "- education\n- work_experience\n- languages"
+        return await self._parse_document(document, parser)
+
+    async def _match_positions(self, resume_data: Dict, positions: List[str]) -> List[Dict]:
+        position_prompt = (
+            "Based on the candidate's resume data below, determine which of the following job positions "
+            "they are best suited for. For each match, explain briefly why they are suitable.\n\n"
+            f"Candidate resume:\n{json.dumps(resume_data, indent=2)}\n\n"
+            f"Available positions:\n{json.dumps(positions)}\n\n"
+            "Return the result in this JSON format:\n"
+            "{ matched_positions: [ { position: string, reason: string } ] }"
         )
-        
-        # Default custom fields
-        custom_fields = custom_fields or {
-            "current_company": "string",
-            "current_position": "string",
-            "profile_summary": "string",
-            "dob": "date",
-            "linkedin": "string",
-            "facebook": "string",
-            "skill_summary": "string",
-            "gender": "string",
-            "race": "string",
-            "marital_status": "string",
-            "country": "string",
-            "malaysia_new_ic": "string",
-            "malaysia_old_ic": "string",
-            "passport_no": "string",
-            "certifications": "array_string"
-        }
 
-        if custom_fields:
-            prompt += "\nAlso include the following custom fields:\n" + "\n".join(f"- {field} ({ftype})" for field, ftype in custom_fields.items())
-
-        # Build schema
-        properties = {
-            "name": genai.types.Schema(type=self.TYPE_MAP["string"]),
-            "phone": genai.types.Schema(type=self.TYPE_MAP["string"]),
-            "email": genai.types.Schema(type=self.TYPE_MAP["string"]),
-            "address": genai.types.Schema(type=self.TYPE_MAP["string"]),
-            "skills": genai.types.Schema(type=self.TYPE_MAP["array_string"], items=genai.types.Schema(type=self.TYPE_MAP["string"])),
-            "years_of_experience": genai.types.Schema(type=self.TYPE_MAP["number"]),
-            "education": genai.types.Schema(
-                type=self.TYPE_MAP["array_string"],
-                items=genai.types.Schema(
-                    type=self.TYPE_MAP["object"],
-                    properties={
-                        "college_university": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "qualification": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "grade": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "cgpa": genai.types.Schema(type=self.TYPE_MAP["number"]),  # Optional if applicable
-                        "major": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "completion_year": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "field_of_study": genai.types.Schema(
-                            type=self.TYPE_MAP["array_string"],
-                            items=genai.types.Schema(type=self.TYPE_MAP["string"])
-                        ),
-                    }
-                )
-            ),
-            "work_experience": genai.types.Schema(
-                type=self.TYPE_MAP["array_string"],
-                items=genai.types.Schema(
-                    type=self.TYPE_MAP["object"],
-                    properties={
-                        "company": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "role": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "start_date": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "end_date": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "description": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                    }
-                )
-            ),
-            "languages": genai.types.Schema(
-                type=self.TYPE_MAP["array_string"],
-                items=genai.types.Schema(
-                    type=self.TYPE_MAP["object"],
-                    properties={
-                        "language": genai.types.Schema(type=self.TYPE_MAP["string"]),
-                        "spoken": genai.types.Schema(type=self.TYPE_MAP["number"]),
-                        "written": genai.types.Schema(type=self.TYPE_MAP["number"]),
-                    }
-                )
-            )
-        }
-
-        # Add custom fields to schema
-        for field, ftype in custom_fields.items():
-            field_type = self.TYPE_MAP.get(ftype.lower(), self.TYPE_MAP["string"])
-            if field_type == genai.types.Type.ARRAY:
-                properties[field] = genai.types.Schema(type=field_type, items=genai.types.Schema(type=self.TYPE_MAP["string"]))
-            else:
-                properties[field] = genai.types.Schema(type=field_type)
-
-        schema = genai.types.Schema(type=genai.types.Type.OBJECT, properties=properties)
-        resume_data = await self._parse_document(document, prompt, schema)
-
-        # If positions provided, evaluate them
-        matched_positions = []
-        if positions and resume_data:
-            position_prompt = (
-                "Based on the candidate's resume data below, determine which of the following job positions "
-                "they are best suited for. For each match, explain briefly why they are suitable.\n\n"
-                f"Candidate resume:\n{json.dumps(resume_data, indent=2)}\n\n"
-                f"Available positions:\n{json.dumps(positions)}\n\n"
-                "Return the result in this JSON format:\n"
-                "{ matched_positions: [ { position: string, reason: string } ] }"
-            )
-
-            response = client.models.generate_content(
-                model=settings.GOOGLE_GEMINI_MODEL,
-                contents=[types.Content(role="user", parts=[types.Part(text=position_prompt)])],
-                config=types.GenerateContentConfig(
-                    temperature=0.5,
-                    top_k=40,
-                    top_p=0.95,
-                    max_output_tokens=2048,
-                    response_mime_type="application/json"
-                )
+        response_text = await self._generate(
+            contents=[types.Content(role="user", parts=[types.Part(text=position_prompt)])],
+            config=types.GenerateContentConfig(
+                temperature=0.5,
+                top_k=40,
+                top_p=0.95,
+                max_output_tokens=2048,
+                response_mime_type="application/json"
             )
-            matched_json = extract_json_from_response(response.text)  # Your utility to safely parse the response
-            resume_data["matched_positions"] = matched_json.get("matched_positions", [])
-        
-        return resume_data
+        )
+        matched_json = extract_json_from_response(response_text)  # Your utility to safely parse the response
+        return matched_json.get("matched_positions", [])
 
-    def _build_schema_from_custom_fields(self, custom_fields: Dict[str, str]) -> genai.types.Schema:
-        properties = {}
-        for field, ftype in custom_fields.items():
-            resolved_type = self.TYPE_MAP.get(ftype.lower(), self.TYPE_MAP["string"])
-            if resolved_type == genai.types.Type.ARRAY:
-                properties[field] = genai.types.Schema(type=resolved_type, items=genai.types.Schema(type=self.TYPE_MAP["string"]))
-            else:
-                properties[field] = genai.types.Schema(type=resolved_type)
-        
-        return genai.types.Schema(type=genai.types.Type.OBJECT, properties=properties)
+    CHAT_CONFIG = types.GenerateContentConfig(
+        temperature=0.5,
+        top_k=40,
+        top_p=0.95,
+        max_output_tokens=2048,
+    )
 
     async def chat(self, prompt: str) -> str:
         try:
@@ -264,23 +189,21 @@ class AiService:
                 )
             ]
 
-            config = types.GenerateContentConfig(
-                temperature=0.5,
-                top_k=40,
-                top_p=0.95,
-                max_output_tokens=2048,
-            )
-
-            response = client.models.generate_content(
-                model=settings.GOOGLE_GEMINI_MODEL,
-                contents=contents,
-                config=config,
-            )
-
-            candidates = getattr(response, "candidates", [])
-            if not candidates or not candidates[0].content or not candidates[0].content.parts:
-                raise Exception("Empty response from Gemini")
+            response_text = await self._generate(contents, self.CHAT_CONFIG)
+            if not response_text.strip():
+                raise Exception("Empty response from model")
 
-            return candidates[0].content.parts[0].text.strip()
+            return response_text.strip()
+        except HTTPException:
+            raise
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"AI summary error: {str(e)}")
\ No newline at end of file
+            raise HTTPException(status_code=500, detail=f"AI summary error: {str(e)}")
+
+    async def chat_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Yield the chat answer as text fragments while the model generates it.
+        Closing the iterator (e.g. on client disconnect) ends the upstream stream.
+        """
+        contents = [types.Content(role="user", parts=[types.Part(text=prompt)])]
+        async for text in model_router.generate_stream(contents, self.CHAT_CONFIG, tenant=self.user_id):
+            yield text
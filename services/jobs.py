@@ -0,0 +1,268 @@
+import asyncio
+import fnmatch
+import ipaddress
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+import aiofiles
+import httpx
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+from core.config import settings
+from db.models import AiJob
+from db.mysql import AsyncSessionLocal
+from repositories.ai_jobs import (
+    claim_job, create_job, finish_job, list_queued_job_ids, recover_stale_jobs, touch_job,
+)
+from services.ai_service import AiService
+from services.usage import usage_accountant
+
+logger = logging.getLogger(__name__)
+
+# Job kind -> usage counter it is billed to
+JOB_KINDS = {
+    "receipt": "receipt_scans",
+    "vclaim": "invoice_scans",
+    "resume": "any_scans",
+}
+
+_COPY_CHUNK = 1024 * 1024
+
+
+async def validate_webhook_url(url: str, allowed_hosts: List[str]):
+    """
+    Reject webhook targets that could reach internal services: only http(s)
+    URLs to an allowlisted host, and every address the host resolves to
+    must be public (no private, loopback, link-local or metadata ranges).
+    """
+    if not allowed_hosts:
+        raise HTTPException(status_code=400, detail="Webhooks are not enabled")
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise HTTPException(status_code=400, detail="webhook_url must be an http(s) URL")
+    if not any(fnmatch.fnmatchcase(host, pattern.lower()) for pattern in allowed_hosts):
+        raise HTTPException(status_code=400, detail="webhook_url host is not allowed")
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError):
+        raise HTTPException(status_code=400, detail="webhook_url host cannot be resolved")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise HTTPException(status_code=400, detail="webhook_url must resolve to a public address")
+
+
+class JobRunner:
+    """
+    Runs queued ai_jobs on a fixed pool of asyncio workers.
+
+    Jobs are persisted in MySQL and their uploads spooled to JOB_SPOOL_DIR.
+    A local spool is only readable on this host, so jobs record the host
+    that spooled them and only that host's processes claim or recover them;
+    with a shared spool (JOB_SPOOL_SHARED) any process can. New jobs are
+    handed to local workers straight away; a poll loop also claims queued
+    jobs left by other or restarted processes and requeues running jobs
+    whose heartbeat went stale. Claims are atomic, so a job runs in exactly
+    one worker at a time.
+    """
+
+    def __init__(self, workers: int, spool_dir: str, spool_shared: bool, poll_interval: float, stale_seconds: float, max_attempts: int):
+        self.workers = workers
+        self.spool_dir = spool_dir
+        self.spool_host = None if spool_shared else socket.gethostname()
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks = []
+
+        self.running = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.recovered = 0
+
+    async def submit(
+        self,
+        user_id: int,
+        kind: str,
+        document: UploadFile,
+        params: Dict,
+        webhook_url: Optional[str] = None,
+    ) -> AiJob:
+        job_id = str(uuid.uuid4())
+        os.makedirs(self.spool_dir, exist_ok=True)
+        file_path = os.path.join(self.spool_dir, job_id)
+        async with aiofiles.open(file_path, "wb") as out:
+            while chunk := await document.read(_COPY_CHUNK):
+                await out.write(chunk)
+
+        job = AiJob(
+            id=job_id,
+            user_id=user_id,
+            kind=kind,
+            status="queued",
+            params=json.dumps(params),
+            filename=document.filename,
+            content_type=document.content_type,
+            file_path=file_path,
+            spool_host=self.spool_host,
+            webhook_url=webhook_url,
+        )
+        async with AsyncSessionLocal() as db:
+            await create_job(db, job)
+        self._queue.put_nowait(job_id)
+        return job
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self):
+        # Running jobs are abandoned; their heartbeat goes stale and they are requeued
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _poll(self):
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    recovered, failed_jobs = await recover_stale_jobs(db, self.stale_seconds, self.max_attempts, self.spool_host)
+                    self.recovered += recovered
+                    for failed_job in failed_jobs:
+                        usage_accountant.refund(failed_job.user_id, JOB_KINDS[failed_job.kind])
+                        if failed_job.file_path:
+                            self._remove_spool(failed_job.file_path)
+                    # Only fetch work when local workers are idle
+                    if self._queue.empty() and self.running < self.workers:
+                        for job_id in await list_queued_job_ids(db, self.workers, self.spool_host):
+                            self._queue.put_nowait(job_id)
+            except Exception as e:
+                logger.error(f"Job poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                async with AsyncSessionLocal() as db:
+                    if not await claim_job(db, job_id, self.spool_host):
+                        continue
+                    job = await db.get(AiJob, job_id)
+                self.running += 1
+                try:
+                    await self._run(job)
+                finally:
+                    self.running -= 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} crashed: {e}")
+
+    async def _run(self, job: AiJob):
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        status, result, error = "failed", None, None
+        try:
+            result = await self._parse(job)
+            if result is None:
+                error = "Failed to parse document"
+            else:
+                status = "succeeded"
+        except HTTPException as e:
+            error = str(e.detail)
+        except Exception as e:
+            error = str(e)
+        finally:
+            heartbeat.cancel()
+
+        async with AsyncSessionLocal() as db:
+            await finish_job(db, job.id, status, json.dumps(result) if result is not None else None, error)
+        if status == "succeeded":
+            self.succeeded += 1
+        else:
+            # Give back the quota reserved when the job was submitted
+            usage_accountant.refund(job.user_id, JOB_KINDS[job.kind])
+            self.failed += 1
+
+        self._remove_spool(job.file_path)
+
+        if job.webhook_url:
+            await self._notify(job, status, result, error)
+
+    @staticmethod
+    def _remove_spool(file_path: str):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    async def _parse(self, job: AiJob) -> Optional[Dict]:
+        params = json.loads(job.params or "{}")
+        headers = Headers({"content-type": job.content_type or "application/octet-stream"})
+        with open(job.file_path, "rb") as fh:
+            document = UploadFile(file=fh, filename=job.filename, headers=headers)
+            ai_service = AiService(user_id=job.user_id)
+            if job.kind == "receipt":
+                return await ai_service.receipt_parser(document)
+            if job.kind == "vclaim":
+                return await ai_service.vclaim_parser(document, params.get("custom_fields"))
+            return await ai_service.resume_parser(document=document, positions=params.get("positions"))
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.stale_seconds / 3)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await touch_job(db, job_id)
+            except Exception as e:
+                logger.warning(f"Job {job_id} heartbeat failed: {e}")
+
+    async def _notify(self, job: AiJob, status: str, result: Optional[Dict], error: Optional[str]):
+        try:
+            # Checked again at delivery: the allowlist may have changed or the host now resolve elsewhere
+            await validate_webhook_url(job.webhook_url, settings.JOB_WEBHOOK_ALLOWED_HOSTS)
+            # Redirects are not followed, so a 3xx cannot bounce the POST to an internal host
+            async with httpx.AsyncClient(timeout=settings.JOB_WEBHOOK_TIMEOUT, follow_redirects=False) as client:
+                response = await client.post(job.webhook_url, json={
+                    "job_id": job.id,
+                    "status": status,
+                    "result": result,
+                    "error": error,
+                })
+                response.raise_for_status()
+        except HTTPException as e:
+            logger.warning(f"Webhook for job {job.id} refused: {e.detail}")
+        except Exception as e:
+            logger.warning(f"Webhook for job {job.id} failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "local_queue": self._queue.qsize(),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "recovered": self.recovered,
+        }
+
+
+job_runner = JobRunner(
+    workers=settings.JOB_WORKERS,
+    spool_dir=settings.JOB_SPOOL_DIR,
+    spool_shared=settings.JOB_SPOOL_SHARED,
+    poll_interval=settings.JOB_POLL_INTERVAL,
+    stale_seconds=settings.JOB_STALE_SECONDS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+)
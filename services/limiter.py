@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from fastapi import HTTPException, status
+from core.metrics import LatencyStats
+
+# (finish tag, arrival order, start tag, tenant): one entry per tenant with waiters
+_HeapEntry = Tuple[float, int, float, Hashable]
+
+
+class _TenantQueue:
+    def __init__(self):
+        self.last_finish = 0.0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.entry: Optional[_HeapEntry] = None
+        self.in_flight = 0
+        self.last_active = time.monotonic()
+        self.dispatched = 0
+        self.rejected = 0
+        self.wait = LatencyStats(window=200)
+
+    def stats(self) -> dict:
+        wait = self.wait.stats()
+        return {
+            "depth": len(self.waiters),
+            "in_flight": self.in_flight,
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "wait_avg_ms": wait["avg_ms"],
+            "wait_p95_ms": wait["p95_ms"],
+        }
+
+
+class ModelCallLimiter:
+    """
+    Process-wide cap on concurrent model calls, shared fairly between tenants.
+
+    Callers wait up to `queue_timeout` seconds for a free slot; after that the
+    request is rejected with a 503 instead of piling up in the worker.
+
+    Waiters are served by weighted fair queueing rather than FIFO. Each
+    tenant waits in its own FIFO; only the head is tagged, with virtual
+    finish time max(V, tenant's last finish) + 1 / weight, and the smallest
+    tag goes next. A tenant is charged for a call only when it is
+    dispatched, so waiters that time out or are cancelled cost nothing. A
+    tenant with thousands of queued calls cannot starve one with a few, and
+    a tenant with weight 2 gets twice the share of a busy pool as one with
+    weight 1. `weight_for` maps a tenant (user id) to its weight; calls
+    without a tenant share one anonymous queue. Tenants idle for
+    `tenant_idle_seconds` are forgotten.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        queue_timeout: float,
+        weight_for: Optional[Callable[[Optional[Hashable]], float]] = None,
+        tenant_idle_seconds: float = 300.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.weight_for = weight_for or (lambda tenant: 1.0)
+        self.tenant_idle_seconds = tenant_idle_seconds
+        self._available = max_concurrency
+        self._virtual_time = 0.0
+        self._heap: List[_HeapEntry] = []
+        self._seq = itertools.count()
+        self._tenants: Dict[Hashable, _TenantQueue] = {}
+        self._next_eviction = time.monotonic() + tenant_idle_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def _queue(self, tenant: Hashable) -> _TenantQueue:
+        queue = self._tenants.get(tenant)
+        if queue is None:
+            queue = self._tenants[tenant] = _TenantQueue()
+        queue.last_active = time.monotonic()
+        return queue
+
+    def _start_tag(self, queue: _TenantQueue) -> float:
+        return max(self._virtual_time, queue.last_finish)
+
+    def _charge(self, tenant: Hashable, queue: _TenantQueue, start: float):
+        queue.last_finish = start + 1.0 / max(self.weight_for(tenant), 1e-6)
+        self._virtual_time = max(self._virtual_time, start)
+        queue.dispatched += 1
+        queue.in_flight += 1
+
+    def _schedule(self, tenant: Hashable, queue: _TenantQueue):
+        # Tag the tenant's current head; called when it becomes backlogged or its head was dispatched
+        start = self._start_tag(queue)
+        finish = start + 1.0 / max(self.weight_for(tenant), 1e-6)
+        queue.entry = (finish, next(self._seq), start, tenant)
+        heapq.heappush(self._heap, queue.entry)
+
+    def _unschedule(self, queue: _TenantQueue):
+        # Its last waiter left without being served: drop the entry, the tag was never charged
+        self._heap.remove(queue.entry)
+        heapq.heapify(self._heap)
+        queue.entry = None
+
+    async def _acquire(self, tenant: Hashable):
+        queue = self._queue(tenant)
+        if self._available > 0 and not self._heap:
+            self._available -= 1
+            self._charge(tenant, queue, self._start_tag(queue))
+            queue.wait.observe(0.0)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.waiters.append(waiter)
+        if queue.entry is None:
+            self._schedule(tenant, queue)
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                queue.in_flight -= 1
+                self._release()
+            else:
+                if waiter in queue.waiters:
+                    queue.waiters.remove(waiter)
+                if not queue.waiters and queue.entry is not None:
+                    self._unschedule(queue)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            queue.rejected += 1
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI service is busy, please retry later"
+            )
+        finally:
+            self.waiting -= 1
+        queue.wait.observe(time.monotonic() - queued_at)
+
+    def _release(self):
+        while self._heap:
+            _, _, start, tenant = heapq.heappop(self._heap)
+            queue = self._tenants[tenant]
+            queue.entry = None
+            # Skip waiters that gave up and are still unwinding
+            while queue.waiters and queue.waiters[0].done():
+                queue.waiters.popleft()
+            if not queue.waiters:
+                continue
+            # Hand the slot straight to the tenant with the smallest finish tag
+            waiter = queue.waiters.popleft()
+            self._charge(tenant, queue, start)
+            waiter.set_result(None)
+            if queue.waiters:
+                self._schedule(tenant, queue)
+            return
+        self._available += 1
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        if now < self._next_eviction:
+            return
+        self._next_eviction = now + self.tenant_idle_seconds
+        # Usage before a whole idle window no longer counts against a tenant, so forgetting it is safe
+        idle = [
+            tenant for tenant, queue in self._tenants.items()
+            if not queue.waiters and not queue.in_flight and now - queue.last_active >= self.tenant_idle_seconds
+        ]
+        for tenant in idle:
+            del self._tenants[tenant]
+        self.evicted += len(idle)
+
+    @asynccontextmanager
+    async def slot(self, tenant: Optional[Hashable] = None):
+        await self._acquire(tenant)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._tenants[tenant].in_flight -= 1
+            self._release()
+            self._evict_idle()
+
+    def has_capacity(self) -> bool:
+        return self._available > 0 and not self._heap
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "tenants_evicted": self.evicted,
+            # Per-tenant queue depth and wait, for tenants active within tenant_idle_seconds
+            "tenants": {str(tenant): queue.stats() for tenant, queue in self._tenants.items()},
+        }
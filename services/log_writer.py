@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import random
+from typing import Dict, List, Optional
+from core.config import settings
+from db.mysql import AsyncSessionLocal, insert_rows, is_deadlock
+from repositories.api_usage import increment_monthly_rollup
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop", "sample", "block")
+DEADLOCK_RETRIES = 3
+
+_STOP = object()
+
+
+class ApiCallLogWriter:
+    """
+    Buffers api_call_logs rows in an in-process queue and writes them with
+    multi-row INSERTs from a background task.
+
+    A batch is flushed when it reaches `batch_size` rows or `flush_interval`
+    seconds after its first row, whichever comes first. When the queue is
+    under pressure the overflow policy decides what happens to new rows:
+
+    - drop:   discard rows once the queue is full
+    - sample: once the queue is half full keep only `sample_rate` of rows,
+              drop when full
+    - block:  wait for space (back-pressure onto the request)
+
+    Each batch also bumps the api_usage_monthly rollup in the same
+    transaction, so the rollup never drifts from the log.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        max_queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        overflow_policy: str = "drop",
+        sample_rate: float = 0.1,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.sample_rate = sample_rate
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.deadlock_retries = 0
+
+    async def submit(self, row: Dict):
+        if self.overflow_policy == "block":
+            await self._queue.put(row)
+            self.enqueued += 1
+            return
+
+        if self.overflow_policy == "sample" and self._queue.qsize() * 2 >= self._queue.maxsize:
+            if random.random() >= self.sample_rate:
+                self.dropped += 1
+                return
+
+        try:
+            self._queue.put_nowait(row)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Flush everything queued so far and stop the background task.
+        """
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Log writer did not drain within {timeout}s, {self._queue.qsize()} rows lost")
+            self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Dict]):
+        for attempt in range(1, DEADLOCK_RETRIES + 1):
+            try:
+                async with AsyncSessionLocal() as db:
+                    await insert_rows(db, self.table_name, batch, commit=False)
+                    await increment_monthly_rollup(db, batch)
+                    await db.commit()
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                if is_deadlock(e) and attempt < DEADLOCK_RETRIES:
+                    # Another worker's rollup upsert won the row locks; the whole transaction was rolled back
+                    self.deadlock_retries += 1
+                    await asyncio.sleep(random.uniform(0.05, 0.2) * attempt)
+                    continue
+                self.failed += len(batch)
+                logger.error(f"Failed to write {len(batch)} rows to {self.table_name}: {e}")
+                return
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_size": self._queue.maxsize,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "deadlock_retries": self.deadlock_retries,
+        }
+
+
+api_call_log_writer = ApiCallLogWriter(
+    table_name="api_call_logs",
+    max_queue_size=settings.LOG_QUEUE_MAX_SIZE,
+    batch_size=settings.LOG_BATCH_SIZE,
+    flush_interval=settings.LOG_FLUSH_INTERVAL,
+    overflow_policy=settings.LOG_OVERFLOW_POLICY,
+    sample_rate=settings.LOG_SAMPLE_RATE,
+)
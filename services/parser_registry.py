@@ -0,0 +1,201 @@
+import json
+import os
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from google.genai import types
+from core.config import settings
+
+DEFAULT_DEFINITIONS_PATH = os.path.join(os.path.dirname(__file__), "parsers.json")
+
+# Field type names accepted in definitions and in request custom_fields
+SCALAR_TYPES = {
+    "string": types.Type.STRING,
+    "number": types.Type.NUMBER,
+    "date": types.Type.STRING,  # Dates as YYYY-MM-DD strings
+    "object": types.Type.OBJECT,
+}
+FIELD_TYPES = set(SCALAR_TYPES) | {"array_string"}
+
+# Normalized custom_fields: (name, type) pairs in request order, unknown types as "string"
+CanonicalFields = Tuple[Tuple[str, str], ...]
+
+
+@dataclass(frozen=True)
+class ParserDefinition:
+    name: str
+    prompt: str
+    fields: Dict[str, Any] = field(default_factory=dict, hash=False)
+    required: List[str] = field(default_factory=list, hash=False)
+    custom_fields_prompt: Optional[str] = None
+    default_custom_fields: Dict[str, str] = field(default_factory=dict, hash=False)
+    model: str = ""
+    config: Dict[str, Any] = field(default_factory=dict, hash=False)
+    counter: Optional[str] = None
+    grayscale: bool = False
+    text_layer: bool = False
+    # Used by other flows (e.g. the single-pass resume call), not served by /ai/parsers/{name}
+    internal: bool = False
+
+    @property
+    def accepts_custom_fields(self) -> bool:
+        return self.custom_fields_prompt is not None
+
+
+@dataclass(frozen=True)
+class CompiledParser:
+    """Everything a model call needs, built once per (parser, custom_fields)."""
+    name: str
+    prompt: str
+    schema: types.Schema
+    schema_json: str
+    # Prompt with custom fields sorted by name, so field order does not split the result cache
+    cache_prompt: str
+    config: types.GenerateContentConfig
+    model: str
+    grayscale: bool
+    text_layer: bool
+
+    def with_instructions(self, text: str) -> "CompiledParser":
+        """Append per-request instructions to the prompt sent and to the one the result cache keys on."""
+        return replace(self, prompt=self.prompt + text, cache_prompt=self.cache_prompt + text)
+
+
+def canonical_fields(custom_fields: Dict[str, str]) -> CanonicalFields:
+    if not isinstance(custom_fields, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in custom_fields.items()):
+        raise HTTPException(status_code=400, detail="custom_fields must be an object mapping field names to type names")
+    canonical = []
+    for name, ftype in custom_fields.items():
+        ftype = ftype.strip().lower()
+        canonical.append((name.strip(), ftype if ftype in FIELD_TYPES else "string"))
+    return tuple(canonical)
+
+
+def _custom_fields_prompt(definition: ParserDefinition, custom_fields: CanonicalFields) -> str:
+    if not custom_fields:
+        return definition.prompt
+    return definition.prompt + definition.custom_fields_prompt + "\n".join(f"- {field} ({ftype})" for field, ftype in custom_fields)
+
+
+def _field_schema(spec: Any) -> types.Schema:
+    if isinstance(spec, str):
+        ftype = spec.strip().lower()
+        if ftype == "array_string":
+            return types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING))
+        return types.Schema(type=SCALAR_TYPES.get(ftype, types.Type.STRING))
+    if isinstance(spec, dict) and spec.get("type") == "array":
+        return types.Schema(type=types.Type.ARRAY, items=_field_schema(spec["items"]))
+    if isinstance(spec, dict) and spec.get("type") == "object":
+        return types.Schema(
+            type=types.Type.OBJECT,
+            properties={name: _field_schema(sub) for name, sub in spec["properties"].items()},
+        )
+    raise ValueError(f"Invalid field spec: {spec!r}")
+
+
+class ParserRegistry:
+    """
+    Document parsers declared in JSON (prompt, fields, model, config) instead
+    of code. Compiled prompt/schema/config objects are memoized per parser and
+    normalized custom_fields, so requests never rebuild schema trees.
+
+    A definition may name another in "extends" to inherit its keys; its
+    "fields" are merged with the base definition's. "internal" is never
+    inherited.
+    """
+
+    def __init__(self, definitions: Dict[str, ParserDefinition], schema_cache_size: int):
+        self._definitions = definitions
+        self._compile = lru_cache(maxsize=schema_cache_size)(self._build)
+        # Fail at startup on a broken field spec rather than on first use
+        for definition in definitions.values():
+            _field_schema({"type": "object", "properties": {**definition.fields, **definition.default_custom_fields}})
+
+    @classmethod
+    def load(cls, path: str, schema_cache_size: int) -> "ParserRegistry":
+        with open(path) as f:
+            raw: Dict[str, Dict[str, Any]] = json.load(f)
+
+        def resolve(name: str, seen: Tuple[str, ...] = ()) -> Dict[str, Any]:
+            if name in seen:
+                raise ValueError(f"Circular 'extends' in parser definitions: {' -> '.join(seen + (name,))}")
+            entry = dict(raw[name])
+            base = entry.pop("extends", None)
+            if not base:
+                return entry
+            inherited = resolve(base, seen + (name,))
+            inherited.pop("internal", None)
+            # Fields are added to the base definition's; every other key replaces it
+            return {**inherited, **entry, "fields": {**inherited.get("fields", {}), **entry.get("fields", {})}}
+
+        definitions = {}
+        for name in raw:
+            entry = resolve(name)
+            custom = entry.pop("custom_fields", None)
+            definitions[name] = ParserDefinition(
+                name=name,
+                custom_fields_prompt=custom["prompt"] if custom else None,
+                default_custom_fields=custom.get("default", {}) if custom else {},
+                **entry,
+            )
+        return cls(definitions, schema_cache_size)
+
+    def names(self) -> List[str]:
+        return list(self._definitions)
+
+    def get(self, name: str) -> Optional[ParserDefinition]:
+        return self._definitions.get(name)
+
+    def compile(self, name: str, custom_fields: Optional[Dict[str, str]] = None) -> CompiledParser:
+        definition = self._definitions[name]
+        if definition.accepts_custom_fields:
+            fields = canonical_fields(custom_fields or definition.default_custom_fields)
+        else:
+            fields = ()
+        return self._compile(name, fields)
+
+    def _build(self, name: str, custom_fields: CanonicalFields) -> CompiledParser:
+        definition = self._definitions[name]
+
+        prompt = _custom_fields_prompt(definition, custom_fields)
+
+        properties = {field: _field_schema(spec) for field, spec in definition.fields.items()}
+        for field, ftype in custom_fields:
+            properties[field] = _field_schema(ftype)
+        schema = types.Schema(type=types.Type.OBJECT, required=definition.required or None, properties=properties)
+
+        config = dict(definition.config)
+        thinking_budget = config.pop("thinking_budget", 0)
+        return CompiledParser(
+            name=name,
+            prompt=prompt,
+            schema=schema,
+            # Keys sorted so the result cache key does not depend on custom field order
+            schema_json=json.dumps(schema.model_dump(mode="json", exclude_none=True), sort_keys=True),
+            cache_prompt=_custom_fields_prompt(definition, tuple(sorted(custom_fields))),
+            config=types.GenerateContentConfig(
+                thinking_config=types.ThinkingConfig(thinking_budget=thinking_budget),
+                response_mime_type="application/json",
+                response_schema=schema,
+                **config,
+            ),
+            model=definition.model or settings.GOOGLE_GEMINI_MODEL,
+            grayscale=definition.grayscale,
+            text_layer=definition.text_layer,
+        )
+
+    def stats(self) -> dict:
+        info = self._compile.cache_info()
+        return {
+            "parsers": len(self._definitions),
+            "compiled": info.currsize,
+            "hits": info.hits,
+            "misses": info.misses,
+        }
+
+
+parser_registry = ParserRegistry.load(
+    settings.PARSER_DEFINITIONS_PATH or DEFAULT_DEFINITIONS_PATH,
+    settings.PARSER_SCHEMA_CACHE_SIZE,
+)
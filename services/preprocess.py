@@ -0,0 +1,217 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/bmp", "image/tiff"}
+PDF_TYPE = "application/pdf"
+OUTPUT_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+MIN_PAGE_CHARS = 50
+
+
+def _shrink_image(data: bytes, max_edge: int, output_format: str, quality: int, grayscale: bool) -> bytes:
+    # Runs in a worker process
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format=output_format, quality=quality, optimize=True)
+        return out.getvalue()
+
+
+def _pdf_text_layer(data: bytes, max_pages: int) -> Optional[Tuple[str, int, int]]:
+    # Runs in a worker process; returns (text, page count, pages carrying text),
+    # or None when the document is too long to send as text
+    import pymupdf
+
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        if doc.page_count > max_pages:
+            return None
+        pages = [page.get_text("text", sort=True).strip() for page in doc]
+    # A stray page number or header on a scanned page does not count as a text layer
+    return "\n\n".join(pages), len(pages), sum(1 for text in pages if len(text) >= MIN_PAGE_CHARS)
+
+
+def _compact_pdf(data: bytes) -> bytes:
+    # Runs in a worker process; drops unused objects and recompresses streams
+    import pymupdf
+
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        return doc.tobytes(garbage=3, deflate=True, clean=True)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: never fork a process that is running an event loop and threads
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def _run_in_pool(timeout: float, func: Callable[..., Any], *args) -> Any:
+    global _pool
+    pool = _executor()
+    try:
+        return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(pool, func, *args), timeout=timeout)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge image); the pool refuses all further work, so start a fresh one
+        if _pool is pool:
+            logger.warning("Pre-processing pool broken, restarting it")
+            _pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class Preprocessor:
+    """
+    Shrinks uploads before they are sent to the model: EXIF-aware rotation,
+    downscale to `max_edge`, re-encode (and optionally grayscale) images;
+    rewrite PDFs compactly. Work runs on a process pool so the event loop and
+    the GIL stay free. The original is kept whenever processing fails, times
+    out or does not make the file smaller.
+    """
+
+    def __init__(self, max_edge: int, output_format: str, quality: int, min_bytes: int, timeout: float):
+        if output_format not in OUTPUT_TYPES:
+            raise ValueError(f"Unsupported preprocess format: {output_format}")
+        self.max_edge = max_edge
+        self.output_format = output_format
+        self.quality = quality
+        self.min_bytes = min_bytes
+        self.timeout = timeout
+
+        self.files = 0
+        self.skipped = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def process(self, data: bytes, mime_type: str, grayscale: bool = False) -> Tuple[bytes, str]:
+        if len(data) < self.min_bytes or (mime_type not in IMAGE_TYPES and mime_type != PDF_TYPE):
+            self.skipped += 1
+            return data, mime_type
+
+        if mime_type == PDF_TYPE:
+            func, args, out_type = _compact_pdf, (data,), PDF_TYPE
+        else:
+            func = _shrink_image
+            args = (data, self.max_edge, self.output_format, self.quality, grayscale)
+            out_type = OUTPUT_TYPES[self.output_format]
+
+        try:
+            processed = await _run_in_pool(self.timeout, func, *args)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Preprocessing {mime_type} ({len(data)} bytes) failed, sending original: {e!r}")
+            return data, mime_type
+
+        if len(processed) >= len(data):
+            self.skipped += 1
+            return data, mime_type
+
+        self.files += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(processed)
+        logger.debug(f"Preprocessed {mime_type}: {len(data)} -> {len(processed)} bytes")
+        return processed, out_type
+
+    def stats(self) -> dict:
+        return {
+            "files": self.files,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "saved_ratio": round(1 - self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+        }
+
+
+class TextLayerExtractor:
+    """
+    Pulls the embedded text layer out of digitally generated PDFs so they can
+    be sent to the model as plain text. Returns None (use the binary path)
+    when too few pages carry text, as with scanned documents.
+    """
+
+    def __init__(self, min_coverage: float, min_chars: int, max_pages: int, timeout: float):
+        self.min_coverage = min_coverage
+        self.min_chars = min_chars
+        self.max_pages = max_pages
+        self.timeout = timeout
+
+        self.used = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.chars_out = 0
+
+    async def extract(self, data: bytes) -> Optional[str]:
+        try:
+            extracted = await _run_in_pool(self.timeout, _pdf_text_layer, data, self.max_pages)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"PDF text layer extraction failed, sending file: {e!r}")
+            return None
+
+        if extracted is None:
+            self.fallbacks += 1
+            return None
+        text, pages, text_pages = extracted
+        if not pages or text_pages / pages < self.min_coverage or len(text) < self.min_chars:
+            self.fallbacks += 1
+            return None
+
+        self.used += 1
+        self.bytes_in += len(data)
+        self.chars_out += len(text)
+        return text
+
+    def stats(self) -> dict:
+        return {
+            "used": self.used,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+            "bytes_in": self.bytes_in,
+            "chars_out": self.chars_out,
+        }
+
+
+text_layer_extractor = TextLayerExtractor(
+    min_coverage=settings.PDF_TEXT_MIN_COVERAGE,
+    min_chars=settings.PDF_TEXT_MIN_CHARS,
+    max_pages=settings.PDF_TEXT_MAX_PAGES,
+    timeout=settings.PREPROCESS_TIMEOUT,
+) if settings.PDF_TEXT_LAYER_ENABLED else None
+
+preprocessor = Preprocessor(
+    max_edge=settings.PREPROCESS_MAX_EDGE,
+    output_format=settings.PREPROCESS_FORMAT,
+    quality=settings.PREPROCESS_QUALITY,
+    min_bytes=settings.PREPROCESS_MIN_BYTES,
+    timeout=settings.PREPROCESS_TIMEOUT,
+) if settings.PREPROCESS_ENABLED else None
@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional
+import httpx
+from fastapi import HTTPException
+from google import genai
+from google.genai import types
+from core.config import settings
+from services.limiter import ModelCallLimiter
+from services.resilience import CircuitBreaker, ResilientCaller, is_retryable
+from services.usage import usage_accountant
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MODEL_APIS = ("ollama", "openai")
+
+
+def _resilient_caller(
+    limiter: ModelCallLimiter,
+    failure_threshold: int,
+    reset_timeout: float,
+    max_attempts: int,
+    base_delay: float,
+    max_delay: float,
+    deadline: float,
+    hedge_enabled: bool,
+) -> ResilientCaller:
+    return ResilientCaller(
+        limiter=limiter,
+        breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+        max_attempts=max_attempts,
+        base_delay=base_delay,
+        max_delay=max_delay,
+        deadline=deadline,
+        hedge_enabled=hedge_enabled,
+        hedge_quantile=settings.GEMINI_HEDGE_QUANTILE,
+        hedge_min_delay=settings.GEMINI_HEDGE_MIN_DELAY,
+        hedge_min_samples=settings.GEMINI_HEDGE_MIN_SAMPLES,
+    )
+
+
+def _provider_unavailable(exc: Exception) -> bool:
+    # Busy / circuit open (503), or transient upstream errors that outlasted the retries
+    if isinstance(exc, HTTPException):
+        return exc.status_code == 503
+    return is_retryable(exc)
+
+
+class ModelProvider(ABC):
+    """
+    A backend that turns genai-style contents and config into text. Each
+    provider owns its concurrency limiter and resilient caller.
+    """
+    name: str
+    limiter: ModelCallLimiter
+    caller: ResilientCaller
+
+    @abstractmethod
+    async def generate(self, contents: List[types.Content], config: types.GenerateContentConfig, model: Optional[str] = None, tenant: Optional[int] = None) -> str:
+        ...
+
+    @abstractmethod
+    def generate_stream(self, contents: List[types.Content], config: types.GenerateContentConfig, tenant: Optional[int] = None) -> AsyncIterator[str]:
+        ...
+
+    def saturated(self) -> bool:
+        return not self.limiter.has_capacity()
+
+    def stats(self) -> dict:
+        return {"limiter": self.limiter.stats(), "resilience": self.caller.stats()}
+
+
+class GeminiProvider(ModelProvider):
+    name = "gemini"
+
+    def __init__(self, client: genai.Client, limiter: ModelCallLimiter, caller: ResilientCaller, model: str):
+        self.client = client
+        self.limiter = limiter
+        self.caller = caller
+        self.model = model
+
+    async def generate(self, contents: List[types.Content], config: types.GenerateContentConfig, model: Optional[str] = None, tenant: Optional[int] = None) -> str:
+        # The resilient caller takes a limiter slot per attempt and retries/hedges as configured
+        response = await self.caller.call(lambda: self.client.aio.models.generate_content(
+            model=model or self.model,
+            contents=contents,
+            config=config,
+        ), tenant=tenant)
+        return response.text or ""
+
+    async def generate_stream(self, contents: List[types.Content], config: types.GenerateContentConfig, tenant: Optional[int] = None) -> AsyncIterator[str]:
+        # The limiter slot is held until the stream ends or the consumer stops iterating
+        async with self.limiter.slot(tenant):
+            stream = await self.caller.call(lambda: self.client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=contents,
+                config=config,
+            ), stream=True)
+            try:
+                async for chunk in stream:
+                    if chunk.text:
+                        yield chunk.text
+            finally:
+                await stream.aclose()
+
+
+def _json_schema(schema: types.Schema) -> Dict[str, Any]:
+    # genai Schema -> JSON Schema as accepted by Ollama "format" / OpenAI "response_format"
+    result: Dict[str, Any] = {"type": schema.type.value.lower()} if schema.type else {}
+    if schema.items:
+        result["items"] = _json_schema(schema.items)
+    if schema.properties:
+        result["properties"] = {name: _json_schema(sub) for name, sub in schema.properties.items()}
+    if schema.required:
+        result["required"] = list(schema.required)
+    return result
+
+
+class LocalProvider(ModelProvider):
+    """
+    Local model served over HTTP: Ollama's native /api/chat, or any
+    OpenAI-compatible /v1/chat/completions server (Ollama, vLLM, llama.cpp).
+    Text-only; documents with inline file data are never routed here.
+    """
+    name = "local"
+
+    def __init__(self, base_url: str, model: str, api: str, api_key: str, timeout: float, limiter: ModelCallLimiter, caller: ResilientCaller):
+        if api not in LOCAL_MODEL_APIS:
+            raise ValueError(f"LOCAL_MODEL_API must be one of: {', '.join(LOCAL_MODEL_APIS)}")
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api = api
+        self.api_key = api_key
+        self.timeout = timeout
+        self.limiter = limiter
+        self.caller = caller
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def _path(self) -> str:
+        return "/api/chat" if self.api == "ollama" else "/v1/chat/completions"
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else None
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, headers=headers)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _payload(self, contents: List[types.Content], config: types.GenerateContentConfig, stream: bool) -> Dict[str, Any]:
+        messages = []
+        for content in contents:
+            if any(part.inline_data for part in content.parts or []):
+                raise ValueError("The local model provider does not accept file data")
+            messages.append({
+                "role": "assistant" if content.role == "model" else "user",
+                "content": "\n".join(part.text for part in content.parts or [] if part.text),
+            })
+
+        json_format = None
+        if config.response_schema is not None:
+            json_format = _json_schema(config.response_schema)
+        elif config.response_mime_type == "application/json":
+            json_format = "json"
+
+        payload: Dict[str, Any] = {"model": self.model, "messages": messages, "stream": stream}
+        if self.api == "ollama":
+            options = {
+                "temperature": config.temperature,
+                "top_p": config.top_p,
+                "top_k": config.top_k,
+                "num_predict": config.max_output_tokens,
+            }
+            payload["options"] = {key: value for key, value in options.items() if value is not None}
+            if json_format is not None:
+                payload["format"] = json_format
+        else:
+            options = {
+                "temperature": config.temperature,
+                "top_p": config.top_p,
+                "max_tokens": config.max_output_tokens,
+            }
+            payload.update({key: value for key, value in options.items() if value is not None})
+            if json_format == "json":
+                payload["response_format"] = {"type": "json_object"}
+            elif json_format is not None:
+                payload["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": json_format}}
+        return payload
+
+    async def _post(self, payload: Dict[str, Any]) -> str:
+        response = await self._http().post(self._path, json=payload)
+        response.raise_for_status()
+        data = response.json()
+        if self.api == "ollama":
+            return data["message"]["content"]
+        return data["choices"][0]["message"]["content"] or ""
+
+    async def _open_stream(self, payload: Dict[str, Any]) -> httpx.Response:
+        client = self._http()
+        response = await client.send(client.build_request("POST", self._path, json=payload), stream=True)
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
+            response.raise_for_status()
+        return response
+
+    async def generate(self, contents: List[types.Content], config: types.GenerateContentConfig, model: Optional[str] = None, tenant: Optional[int] = None) -> str:
+        # `model` names a Gemini model from the parser registry; the local server always uses its own
+        payload = self._payload(contents, config, stream=False)
+        return await self.caller.call(lambda: self._post(payload), tenant=tenant)
+
+    async def generate_stream(self, contents: List[types.Content], config: types.GenerateContentConfig, tenant: Optional[int] = None) -> AsyncIterator[str]:
+        payload = self._payload(contents, config, stream=True)
+        async with self.limiter.slot(tenant):
+            response = await self.caller.call(lambda: self._open_stream(payload), stream=True)
+            try:
+                async for line in response.aiter_lines():
+                    text = self._stream_text(line)
+                    if text:
+                        yield text
+            finally:
+                await response.aclose()
+
+    def _stream_text(self, line: str) -> Optional[str]:
+        # Ollama streams NDJSON; OpenAI-compatible servers stream SSE "data:" lines
+        if self.api == "ollama":
+            return json.loads(line).get("message", {}).get("content") if line.strip() else None
+        if not line.startswith("data:") or line[5:].strip() == "[DONE]":
+            return None
+        choices = json.loads(line[5:]).get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content")
+
+
+class ModelRouter:
+    """
+    Picks a provider per call. Documents with file data always go to Gemini.
+    Text-only prompts up to LOCAL_MODEL_MAX_PROMPT_CHARS without a response
+    schema prefer the local model; everything else prefers Gemini. The other
+    provider is used when the preferred one is saturated (no free limiter
+    slot), rejects the call with a 503 (busy or circuit open), or is still
+    failing with transient errors once its retries are spent. Streams only
+    fall over before their first chunk.
+    """
+
+    def __init__(self, gemini: GeminiProvider, local: Optional[LocalProvider], local_max_prompt_chars: int):
+        self.gemini = gemini
+        self.local = local
+        self.local_max_prompt_chars = local_max_prompt_chars
+        self.routed: Counter = Counter()
+        self.fallbacks = 0
+
+    def candidates(self, contents: List[types.Content], config: types.GenerateContentConfig) -> List[ModelProvider]:
+        if self.local is None:
+            return [self.gemini]
+        parts = [part for content in contents for part in content.parts or []]
+        if any(part.inline_data for part in parts):
+            return [self.gemini]
+        prompt_chars = sum(len(part.text or "") for part in parts)
+        if prompt_chars <= self.local_max_prompt_chars and config.response_schema is None:
+            return [self.local, self.gemini]
+        return [self.gemini, self.local]
+
+    def _pick(self, candidates: List[ModelProvider]) -> List[ModelProvider]:
+        # Saturated providers move to the back, keeping the policy order otherwise
+        ready = [provider for provider in candidates if not provider.saturated()]
+        if ready and ready[0] is not candidates[0]:
+            self.fallbacks += 1
+        return ready + [provider for provider in candidates if provider not in ready]
+
+    async def generate(self, contents: List[types.Content], config: types.GenerateContentConfig, model: Optional[str] = None, tenant: Optional[int] = None) -> str:
+        providers = self._pick(self.candidates(contents, config))
+        for index, provider in enumerate(providers):
+            try:
+                text = await provider.generate(contents, config, model, tenant)
+            except Exception as e:
+                if not _provider_unavailable(e) or index == len(providers) - 1:
+                    raise
+                self.fallbacks += 1
+                logger.info(f"Model provider {provider.name} unavailable ({e!r}), falling back to {providers[index + 1].name}")
+                continue
+            self.routed[provider.name] += 1
+            return text
+
+    async def generate_stream(self, contents: List[types.Content], config: types.GenerateContentConfig, tenant: Optional[int] = None) -> AsyncIterator[str]:
+        providers = self._pick(self.candidates(contents, config))
+        for index, provider in enumerate(providers):
+            started = False
+            try:
+                async for text in provider.generate_stream(contents, config, tenant):
+                    if not started:
+                        started = True
+                        self.routed[provider.name] += 1
+                    yield text
+            except Exception as e:
+                if started or not _provider_unavailable(e) or index == len(providers) - 1:
+                    raise
+                self.fallbacks += 1
+                logger.info(f"Model provider {provider.name} unavailable ({e!r}), falling back to {providers[index + 1].name}")
+                continue
+            if not started:
+                self.routed[provider.name] += 1
+            return
+
+    async def aclose(self):
+        if self.local is not None:
+            await self.local.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "routed": dict(self.routed),
+            "fallbacks": self.fallbacks,
+            "providers": {
+                provider.name: provider.stats()
+                for provider in (self.gemini, self.local) if provider is not None
+            },
+        }
+
+
+# Initialize Gemini Client
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = settings.GOOGLE_APPLICATION_CREDENTIALS
+client = genai.Client(
+    vertexai=True,
+    project=settings.GOOGLE_PROJECT_NAME,
+    location=settings.GOOGLE_PROJECT_LOCATION,
+)
+
+def tenant_weight(user_id: Optional[int]) -> float:
+    # Fair-share weight from the user's subscription, as last loaded by the usage accountant
+    entitlement = usage_accountant.entitlement(user_id) if user_id is not None else None
+    if entitlement is None:
+        return settings.FAIR_SHARE_DEFAULT_WEIGHT
+    return settings.FAIR_SHARE_WEIGHTS.get(entitlement.subscription_name, settings.FAIR_SHARE_DEFAULT_WEIGHT)
+
+
+# Shared by every AiService instance in this worker
+model_call_limiter = ModelCallLimiter(
+    max_concurrency=settings.GEMINI_MAX_CONCURRENCY,
+    queue_timeout=settings.GEMINI_QUEUE_TIMEOUT,
+    weight_for=tenant_weight,
+)
+
+gemini_provider = GeminiProvider(
+    client=client,
+    limiter=model_call_limiter,
+    caller=_resilient_caller(
+        model_call_limiter,
+        failure_threshold=settings.GEMINI_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.GEMINI_BREAKER_RESET_TIMEOUT,
+        max_attempts=settings.GEMINI_RETRY_MAX_ATTEMPTS,
+        base_delay=settings.GEMINI_RETRY_BASE_DELAY,
+        max_delay=settings.GEMINI_RETRY_MAX_DELAY,
+        deadline=settings.GEMINI_CALL_DEADLINE,
+        hedge_enabled=settings.GEMINI_HEDGE_ENABLED,
+    ),
+    model=settings.GOOGLE_GEMINI_MODEL,
+)
+
+local_provider = None
+if settings.LOCAL_MODEL_ENABLED:
+    local_limiter = ModelCallLimiter(
+        max_concurrency=settings.LOCAL_MODEL_MAX_CONCURRENCY,
+        queue_timeout=settings.LOCAL_MODEL_QUEUE_TIMEOUT,
+        weight_for=tenant_weight,
+    )
+    local_provider = LocalProvider(
+        base_url=settings.OLLAMA_HOST,
+        model=settings.OLLAMA_MODEL,
+        api=settings.LOCAL_MODEL_API,
+        api_key=settings.LOCAL_MODEL_API_KEY,
+        timeout=settings.LOCAL_MODEL_TIMEOUT,
+        limiter=local_limiter,
+        caller=_resilient_caller(
+            local_limiter,
+            failure_threshold=settings.LOCAL_MODEL_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=settings.LOCAL_MODEL_BREAKER_RESET_TIMEOUT,
+            max_attempts=settings.LOCAL_MODEL_RETRY_MAX_ATTEMPTS,
+            base_delay=settings.LOCAL_MODEL_RETRY_BASE_DELAY,
+            max_delay=settings.LOCAL_MODEL_RETRY_MAX_DELAY,
+            deadline=settings.LOCAL_MODEL_CALL_DEADLINE,
+            hedge_enabled=False,
+        ),
+    )
+
+model_router = ModelRouter(gemini_provider, local_provider, settings.LOCAL_MODEL_MAX_PROMPT_CHARS)
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+import httpx
+from fastapi import HTTPException, status
+from google.genai import errors
+from core.metrics import LatencyStats
+from services.limiter import ModelCallLimiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, errors.APIError):
+        return exc.code in RETRYABLE_STATUS
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    return isinstance(exc, (TimeoutError, ConnectionError, httpx.TransportError))
+
+
+def is_client_error(exc: BaseException) -> bool:
+    # Upstream answered with a 4xx: it is up, the request itself was rejected
+    if isinstance(exc, errors.APIError):
+        return 400 <= exc.code < 500
+    if isinstance(exc, httpx.HTTPStatusError):
+        return 400 <= exc.response.status_code < 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` upstream failures in a row the circuit opens and
+    calls fail fast for `reset_timeout` seconds. Then a single probe call is
+    let through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        self.opened = 0
+        self.short_circuited = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def retry_after(self) -> int:
+        return max(1, int(self.reset_timeout - (time.monotonic() - self._opened_at)) + 1)
+
+    def release_probe(self):
+        # The half-open probe ended without reaching upstream; let the next call probe
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+                logger.warning(f"Model call circuit opened after {self.consecutive_failures} consecutive failures")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+class ResilientCaller:
+    """
+    Runs model calls through the concurrency limiter with:
+
+    - jittered exponential retry on transient errors (429/5xx, timeouts,
+      connection errors), bounded by `max_attempts` and an overall deadline;
+    - optional hedging: if an attempt runs longer than the recent latency
+      quantile, a second identical request is fired and the loser cancelled
+      (only while the limiter has spare capacity);
+    - a circuit breaker that rejects calls with a 503 while upstream is down.
+    """
+
+    def __init__(
+        self,
+        limiter: ModelCallLimiter,
+        breaker: CircuitBreaker,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        deadline: float,
+        hedge_enabled: bool,
+        hedge_quantile: float,
+        hedge_min_delay: float,
+        hedge_min_samples: int,
+    ):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyStats()
+
+        self.calls = 0
+        self.retries = 0
+        self.exhausted = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    async def call(self, fn: Callable[[], Awaitable[T]], stream: bool = False, tenant: Optional[Hashable] = None) -> T:
+        """
+        Call `fn` (a factory for one upstream request) resiliently, queueing
+        for limiter slots as `tenant`. For streams the caller already holds a
+        limiter slot and only opening the stream is retried; streams are
+        never hedged.
+        """
+        if not self.breaker.allow():
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI service is temporarily unavailable, please retry later",
+                headers={"Retry-After": str(self.breaker.retry_after())},
+            )
+
+        self.calls += 1
+        try:
+            return await self._call(fn, stream, tenant)
+        except BaseException:
+            # Ended without an upstream verdict (local rejection, local bug, or cancellation on
+            # client disconnect / batch cancel): a half-open probe must not stay claimed
+            self.breaker.release_probe()
+            raise
+
+    async def _call(self, fn: Callable[[], Awaitable[T]], stream: bool, tenant: Optional[Hashable]) -> T:
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Model call deadline exceeded")
+                run = fn() if stream else self._attempt(fn, tenant)
+                result = await asyncio.wait_for(run, timeout=remaining)
+            except HTTPException:
+                # Local rejection (e.g. limiter queue timeout), not an upstream fault
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    if is_client_error(e):
+                        # Upstream answered (e.g. 400); it is healthy even if the request was bad
+                        self.breaker.record_success()
+                    # Anything else is a local bug and says nothing about upstream health
+                    raise
+                self.breaker.record_failure()
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                if attempt >= self.max_attempts or self.breaker.state == "open" or time.monotonic() + delay >= deadline:
+                    self.exhausted += 1
+                    raise
+                self.retries += 1
+                logger.info(f"Retrying model call in {delay:.2f}s after attempt {attempt} failed: {e!r}")
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]], tenant: Optional[Hashable]) -> T:
+        async with self.limiter.slot(tenant):
+            started = time.monotonic()
+            result = await fn()
+            self.latency.observe(time.monotonic() - started)
+            return result
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge_enabled or self.latency.count < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_quantile))
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]], tenant: Optional[Hashable]) -> T:
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await self._timed(fn, tenant)
+
+        primary = asyncio.create_task(self._timed(fn, tenant))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done or not self.limiter.has_capacity():
+                return await primary
+
+            self.hedged += 1
+            hedge = asyncio.create_task(self._timed(fn, tenant))
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "retries_exhausted": self.exhausted,
+            "hedge_enabled": self.hedge_enabled,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "latency": self.latency.stats(),
+            "circuit": self.breaker.stats(),
+        }
@@ -0,0 +1,147 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Dict, Iterator, Optional
+from core.cache import TTLCache
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(file_sha256: bytes, prompt: str, schema_json: str, model: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(file_sha256)
+    for part in (prompt, schema_json, model):
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SqliteResultStore:
+    """
+    Disk tier shared by all workers on the host. Calls run in a thread so
+    the event loop never waits on SQLite.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parse_results ("
+                " cache_key TEXT PRIMARY KEY,"
+                " result TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # sqlite3's own context manager only commits; closing() releases the connection too
+        with closing(sqlite3.connect(self.path, timeout=5)) as conn:
+            with conn:
+                yield conn
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result, expires_at FROM parse_results WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                conn.execute("DELETE FROM parse_results WHERE cache_key = ?", (key,))
+                return None
+            return row[0]
+
+    def _set(self, key: str, value: str, ttl_seconds: float):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO parse_results (cache_key, result, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl_seconds),
+            )
+
+    async def get(self, key: str) -> Optional[Dict]:
+        raw = await asyncio.to_thread(self._get, key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Dict, ttl_seconds: float):
+        await asyncio.to_thread(self._set, key, json.dumps(value), ttl_seconds)
+
+
+class ParseResultCache:
+    """
+    Two-tier cache for document parse results: in-memory LRU first, then the
+    optional SQLite store. Failures in the disk tier are logged and ignored.
+    Values are copied in and out, so callers may mutate what they get back.
+    """
+
+    def __init__(self, memory: TTLCache, store: Optional[SqliteResultStore] = None):
+        self.memory = memory
+        self.store = store
+        self.store_hits = 0
+        self.store_errors = 0
+        self.bypassed = 0
+
+    async def get(self, key: str) -> Optional[Dict]:
+        value = self.memory.get(key)
+        if value is not None:
+            return copy.deepcopy(value)
+        if self.store is None:
+            return None
+        try:
+            value = await self.store.get(key)
+        except Exception as e:
+            self.store_errors += 1
+            logger.warning(f"Parse cache store read failed: {e}")
+            return None
+        if value is not None:
+            self.store_hits += 1
+            self.memory.set(key, copy.deepcopy(value))
+        return value
+
+    async def set(self, key: str, value: Dict):
+        self.memory.set(key, copy.deepcopy(value))
+        if self.store is None:
+            return
+        try:
+            await self.store.set(key, value, self.memory.ttl_seconds)
+        except Exception as e:
+            self.store_errors += 1
+            logger.warning(f"Parse cache store write failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            **self.memory.stats(),
+            "store_enabled": self.store is not None,
+            "store_hits": self.store_hits,
+            "store_errors": self.store_errors,
+            "bypassed": self.bypassed,
+        }
+
+
+def build_parse_result_cache() -> Optional[ParseResultCache]:
+    if not settings.AI_CACHE_ENABLED:
+        return None
+    store = None
+    if settings.AI_CACHE_SQLITE_PATH:
+        try:
+            store = SqliteResultStore(settings.AI_CACHE_SQLITE_PATH)
+        except (OSError, sqlite3.Error) as e:
+            # e.g. a non-root worker that cannot create the directory; keep serving from memory
+            logger.warning(f"Parse cache store at {settings.AI_CACHE_SQLITE_PATH} unavailable, using memory only: {e}")
+    return ParseResultCache(
+        memory=TTLCache(settings.AI_CACHE_MAX_ENTRIES, settings.AI_CACHE_TTL_SECONDS),
+        store=store,
+    )
+
+
+parse_result_cache = build_parse_result_cache()
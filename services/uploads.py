@@ -0,0 +1,89 @@
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import HTTPException, UploadFile, status
+
+logger = logging.getLogger(__name__)
+
+try:
+    import magic
+except (ImportError, OSError):
+    # python-magic needs the libmagic system library; fall back to the signature table below
+    magic = None
+
+# Inline file types accepted by the model
+SUPPORTED_TYPES = {
+    "image/jpeg",
+    "image/png",
+    "image/webp",
+    "image/heic",
+    "image/heif",
+    "application/pdf",
+}
+
+SNIFF_BYTES = 2048
+READ_CHUNK_BYTES = 1024 * 1024
+
+_SIGNATURES = (
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"PK\x03\x04", "application/zip"),
+)
+_HEIF_BRANDS = {b"heic": "image/heic", b"heix": "image/heic", b"mif1": "image/heif", b"msf1": "image/heif"}
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """Identify a file type from its first bytes, ignoring what the client declared."""
+    if magic is not None:
+        return magic.from_buffer(head, mime=True)
+    for offset, signature, mime_type in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return _HEIF_BRANDS.get(head[8:12])
+    return None
+
+
+@dataclass(frozen=True)
+class UploadInfo:
+    mime_type: str
+    size_bytes: int
+    sha256: bytes
+
+
+async def inspect_upload(file: UploadFile) -> UploadInfo:
+    """
+    Sniff and hash an upload in fixed-size chunks straight from its spooled
+    temp file, so nothing larger than READ_CHUNK_BYTES lands on the heap
+    before the file is known to be acceptable (or is answered from cache).
+    Raises 415 for missing or unsupported types. Leaves the file at offset 0.
+    """
+    await file.seek(0)
+    digest = hashlib.sha256()
+    head = b""
+    size = 0
+    while chunk := await file.read(READ_CHUNK_BYTES):
+        if not head:
+            head = chunk[:SNIFF_BYTES]
+        digest.update(chunk)
+        size += len(chunk)
+    await file.seek(0)
+
+    mime_type = sniff_mime(head) if head else None
+    if mime_type not in SUPPORTED_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported file type: {mime_type or 'unknown'}",
+        )
+    if mime_type != file.content_type:
+        logger.debug(f"Upload {file.filename!r} declared {file.content_type}, sniffed {mime_type}")
+    return UploadInfo(mime_type=mime_type, size_bytes=size, sha256=digest.digest())
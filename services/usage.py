@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, status
+from core.config import settings
+from db.mysql import AsyncSessionLocal
+from repositories.api_usage import load_active_entitlements, load_period_usage, upsert_usage_increments
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("receipt_scans", "invoice_scans", "any_scans")
+
+
+@dataclass(frozen=True)
+class Entitlement:
+    """
+    Snapshot of a user's active subscription. A limit of 0 means the
+    counter is not metered for that plan.
+    """
+    subscription_id: int
+    subscription_name: str
+    limits: Dict[str, int]
+
+
+def current_period() -> str:
+    return datetime.utcnow().strftime("%Y-%m")
+
+
+class UsageAccountant:
+    """
+    Write-behind usage counters for api_usage.
+
+    Increments are aggregated in memory per (user, period, counter) and
+    flushed periodically with one INSERT ... ON DUPLICATE KEY UPDATE. Each
+    refresh reloads every active entitlement and the period's stored totals,
+    so quota checks are answered from memory and never wait on the database.
+    Users with no snapshot yet (e.g. subscribed since the last refresh) are
+    not limited until the next refresh.
+
+    The first refresh runs in start() and raises, so a worker never serves
+    with an empty snapshot because the query is broken; later failures keep
+    the previous snapshot and are logged as critical and shown in stats().
+    """
+
+    def __init__(self, flush_interval: float, refresh_interval: float):
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self._entitlements: Dict[int, Entitlement] = {}
+        self._baseline_period: Optional[str] = None
+        self._baseline: Dict[int, Dict[str, int]] = {}
+        self._flushed: Dict[Tuple[int, str, str], int] = defaultdict(int)
+        self._pending: Dict[Tuple[int, str, str], int] = defaultdict(int)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+        self.flushes = 0
+        self.flush_failures = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.rejected = 0
+        self.last_refresh_at: Optional[datetime] = None
+        self.last_refresh_error: Optional[str] = None
+
+    def entitlement(self, user_id: int) -> Optional[Entitlement]:
+        return self._entitlements.get(user_id)
+
+    def used(self, user_id: int, counter: str, period: Optional[str] = None) -> int:
+        period = period or current_period()
+        key = (user_id, period, counter)
+        baseline = self._baseline.get(user_id, {}).get(counter, 0) if period == self._baseline_period else 0
+        return baseline + self._flushed.get(key, 0) + self._pending.get(key, 0)
+
+    def check(self, user_id: int, counter: str):
+        entitlement = self._entitlements.get(user_id)
+        if entitlement is None:
+            return
+        limit = entitlement.limits.get(counter, 0)
+        if limit and self.used(user_id, counter) >= limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Monthly {counter} quota of {limit} reached for plan {entitlement.subscription_name}"
+            )
+
+    def record(self, user_id: int, counter: str, amount: int = 1):
+        self._pending[(user_id, current_period(), counter)] += amount
+
+    def reserve(self, user_id: int, counter: str):
+        """
+        Check the quota and count one use in the same step, so concurrent
+        calls (e.g. files of one batch) cannot all pass the same check.
+        Give the unit back with refund() if the call fails.
+        """
+        self.check(user_id, counter)
+        self.record(user_id, counter)
+
+    def refund(self, user_id: int, counter: str):
+        self.record(user_id, counter, -1)
+
+    async def start(self):
+        if self._task is None:
+            await self._load()
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + self.refresh_interval
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if loop.time() >= next_refresh:
+                # Refresh right after a flush so stored totals include what we just wrote
+                await self.refresh()
+                next_refresh = loop.time() + self.refresh_interval
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, defaultdict(int)
+
+        rows: Dict[Tuple[int, str], dict] = {}
+        for (user_id, period, counter), amount in pending.items():
+            row = rows.setdefault((user_id, period), {
+                "user_id": user_id, "period": period, **{name: 0 for name in COUNTERS}
+            })
+            row[counter] += amount
+
+        try:
+            async with AsyncSessionLocal() as db:
+                await upsert_usage_increments(db, list(rows.values()))
+        except Exception as e:
+            self.flush_failures += 1
+            logger.error(f"Usage flush failed, will retry: {e}")
+            for key, amount in pending.items():
+                self._pending[key] += amount
+            return
+
+        self.flushes += 1
+        for key, amount in pending.items():
+            self._flushed[key] += amount
+
+    async def refresh(self):
+        try:
+            await self._load()
+        except Exception as e:
+            self.refresh_failures += 1
+            self.last_refresh_error = repr(e)
+            logger.critical(f"Usage entitlement refresh failed, quotas use the snapshot from {self.last_refresh_at}: {e!r}")
+
+    async def _load(self):
+        period = current_period()
+        async with AsyncSessionLocal() as db:
+            entitlement_rows = await load_active_entitlements(db, date.today())
+            usage_rows = await load_period_usage(db, period)
+
+        entitlements: Dict[int, Entitlement] = {}
+        for row in entitlement_rows:
+            if row.user_id in entitlements:
+                continue
+            entitlements[row.user_id] = Entitlement(
+                subscription_id=row.subscription_id,
+                subscription_name=row.subscription_name,
+                limits={name: getattr(row, name) or 0 for name in COUNTERS},
+            )
+
+        self._entitlements = entitlements
+        self._baseline_period = period
+        self._baseline = {row.user_id: {name: getattr(row, name) or 0 for name in COUNTERS} for row in usage_rows}
+        # Everything flushed so far is now part of the baseline
+        self._flushed = defaultdict(int)
+        self.refreshes += 1
+        self.last_refresh_at = datetime.utcnow()
+        self.last_refresh_error = None
+
+    def stats(self) -> dict:
+        return {
+            "entitlements": len(self._entitlements),
+            "pending_keys": len(self._pending),
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "last_refresh_at": self.last_refresh_at.isoformat() if self.last_refresh_at else None,
+            "last_refresh_error": self.last_refresh_error,
+            "rejected": self.rejected,
+        }
+
+
+usage_accountant = UsageAccountant(
+    flush_interval=settings.USAGE_FLUSH_INTERVAL,
+    refresh_interval=settings.USAGE_REFRESH_INTERVAL,
+)
+